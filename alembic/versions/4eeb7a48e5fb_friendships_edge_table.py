@@ -0,0 +1,84 @@
+"""friendships edge table
+
+Revision ID: 4eeb7a48e5fb
+Revises: f8223dc57f7c
+Create Date: 2025-06-09 14:21:07.518344
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4eeb7a48e5fb"
+down_revision: Union[str, None] = "f8223dc57f7c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ---------------- friendships - user_id, friend_id ----------------
+    # one row per "user_id has friend_id as a friend"
+    op.create_table(
+        "friendships",
+        sa.Column(
+            "user_id",
+            sa.Integer,
+            sa.ForeignKey("users.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column(
+            "friend_id",
+            sa.Integer,
+            sa.ForeignKey("users.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+    )
+
+    # users can't friend themselves
+    op.create_check_constraint(
+        "ck_friendships_not_self", "friendships", sa.text("user_id <> friend_id")
+    )
+
+    # reverse lookups - who has friend_id as a friend
+    op.create_index(
+        "ix_friendships_friend_id_user_id", "friendships", ["friend_id", "user_id"]
+    )
+
+    # backfill from the friends arrays, skipping ids that no longer exist
+    op.execute(
+        """
+        INSERT INTO friendships (user_id, friend_id)
+        SELECT DISTINCT u.id, f.friend_id
+        FROM users u
+        CROSS JOIN LATERAL unnest(u.friends) AS f(friend_id)
+        JOIN users friend ON friend.id = f.friend_id
+        WHERE f.friend_id <> u.id
+        """
+    )
+
+    op.drop_column("users", "friends")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column("users", sa.Column("friends", sa.ARRAY(sa.Integer), nullable=True))
+
+    op.execute(
+        """
+        UPDATE users
+        SET friends = f.friends
+        FROM (
+            SELECT user_id, array_agg(friend_id ORDER BY friend_id) AS friends
+            FROM friendships
+            GROUP BY user_id
+        ) f
+        WHERE f.user_id = users.id
+        """
+    )
+
+    op.drop_table("friendships")
@@ -0,0 +1,51 @@
+"""media rating stats
+
+Revision ID: 9c41f0a7d5e2
+Revises: b7d2e91c4a36
+Create Date: 2025-06-11 16:37:12.804519
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9c41f0a7d5e2"
+down_revision: Union[str, None] = "b7d2e91c4a36"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ---------------- media_rating_stats - media_id, review_count, rating_sum ----------------
+    # running totals kept up to date by review_media, so reads don't have to aggregate reviews
+    op.create_table(
+        "media_rating_stats",
+        sa.Column(
+            "media_id",
+            sa.Integer,
+            sa.ForeignKey("media.media_id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("review_count", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("rating_sum", sa.Float, nullable=False, server_default="0"),
+    )
+
+    # backfill from existing reviews
+    op.execute(
+        """
+        INSERT INTO media_rating_stats (media_id, review_count, rating_sum)
+        SELECT media_id, COUNT(*), SUM(rating)
+        FROM reviews
+        GROUP BY media_id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("media_rating_stats")
@@ -0,0 +1,56 @@
+"""media trigram indexes
+
+Revision ID: b7d2e91c4a36
+Revises: 4eeb7a48e5fb
+Create Date: 2025-06-10 10:02:45.113862
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b7d2e91c4a36"
+down_revision: Union[str, None] = "4eeb7a48e5fb"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+
+    # trigram indexes let LIKE/ILIKE '%x%' on title and director use an index
+    # instead of a sequential scan of media
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    op.execute(
+        """
+        CREATE INDEX index_media_title_trgm
+        ON media USING gin (title gin_trgm_ops)
+        """
+    )
+
+    op.execute(
+        """
+        CREATE INDEX index_media_director_trgm
+        ON media USING gin (director gin_trgm_ops)
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+
+    op.execute(
+        """
+        DROP INDEX IF EXISTS index_media_director_trgm
+        """
+    )
+
+    op.execute(
+        """
+        DROP INDEX IF EXISTS index_media_title_trgm
+        """
+    )
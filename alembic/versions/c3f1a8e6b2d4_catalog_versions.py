@@ -0,0 +1,55 @@
+"""catalog versions
+
+Revision ID: c3f1a8e6b2d4
+Revises: 9c41f0a7d5e2
+Create Date: 2025-06-12 10:04:51.226917
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c3f1a8e6b2d4"
+down_revision: Union[str, None] = "9c41f0a7d5e2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ---------------- catalog_version ----------------
+    # stamps media and rating stats rows every time they change, the versions make up the ETags
+    # of the catalog and review reads. not owned by a column, so TRUNCATE ... RESTART IDENTITY
+    # doesn't reset it and versions are never reused
+    op.execute("CREATE SEQUENCE catalog_version")
+
+    # existing rows are stamped by the column default
+    op.add_column(
+        "media",
+        sa.Column(
+            "version",
+            sa.BigInteger,
+            nullable=False,
+            server_default=sa.text("nextval('catalog_version')"),
+        ),
+    )
+    op.add_column(
+        "media_rating_stats",
+        sa.Column(
+            "version",
+            sa.BigInteger,
+            nullable=False,
+            server_default=sa.text("nextval('catalog_version')"),
+        ),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("media_rating_stats", "version")
+    op.drop_column("media", "version")
+    op.execute("DROP SEQUENCE catalog_version")
@@ -0,0 +1,51 @@
+"""lookup indexes
+
+Revision ID: d9a2c6e4f1b7
+Revises: c3f1a8e6b2d4
+Create Date: 2025-06-13 11:22:37.640185
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d9a2c6e4f1b7"
+down_revision: Union[str, None] = "c3f1a8e6b2d4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # reviews of one title, in user_id order - serves view_reviews' keyset pages without
+    # scanning every review, and the foreign key check when media is deleted
+    op.create_index("ix_reviews_media_id_user_id", "reviews", ["media_id", "user_id"])
+
+    # who has a title on their watchlist - the foreign key check when media is deleted
+    # has nothing else to use, the primary key leads with user_id
+    op.create_index("ix_watchlists_media_id", "watchlists", ["media_id"])
+
+    # get_watchlist(only_watched_media=True) walks a user's watched titles in media_id
+    # order without reading the unwatched ones
+    op.execute(
+        """
+        CREATE INDEX ix_watchlists_user_id_media_id_watched
+        ON watchlists (user_id, media_id)
+        WHERE have_watched
+        """
+    )
+
+    # media.title already has its unique index, which also serves the title and type
+    # duplicate checks, and director substring filters use index_media_director_trgm
+
+    op.execute("ANALYZE reviews, watchlists")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_watchlists_user_id_media_id_watched", table_name="watchlists")
+    op.drop_index("ix_watchlists_media_id", table_name="watchlists")
+    op.drop_index("ix_reviews_media_id_user_id", table_name="reviews")
@@ -0,0 +1,55 @@
+"""media rating average
+
+Revision ID: e5c1b9d3a7f2
+Revises: d9a2c6e4f1b7
+Create Date: 2025-06-16 09:41:18.372604
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e5c1b9d3a7f2"
+down_revision: Union[str, None] = "d9a2c6e4f1b7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # stored average, so view_media can walk titles in rating order from an index instead
+    # of computing every title's average and sorting them all for each page. generated,
+    # so every write to the totals - review upserts, bulk merges, rebuilds - keeps it current
+    op.add_column(
+        "media_rating_stats",
+        sa.Column(
+            "average_rating",
+            sa.Float,
+            sa.Computed(
+                "COALESCE(rating_sum / NULLIF(review_count, 0), 0)", persisted=True
+            ),
+            nullable=False,
+        ),
+    )
+
+    # view_media's order, highest rated first and media_id to break ties
+    op.execute(
+        """
+        CREATE INDEX ix_media_rating_stats_average_rating_media_id
+        ON media_rating_stats (average_rating DESC, media_id)
+        """
+    )
+
+    op.execute("ANALYZE media_rating_stats")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        "ix_media_rating_stats_average_rating_media_id", table_name="media_rating_stats"
+    )
+    op.drop_column("media_rating_stats", "average_rating")
@@ -0,0 +1,57 @@
+"""catalog revision
+
+Revision ID: f1a4c8e2b6d9
+Revises: e5c1b9d3a7f2
+Create Date: 2025-06-17 10:12:43.918265
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f1a4c8e2b6d9"
+down_revision: Union[str, None] = "e5c1b9d3a7f2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ---------------- catalog_revision - one row, version ----------------
+    # bumped by every write to the catalog or its ratings in the write's own transaction,
+    # so view_media's ETag comes from one row instead of summing every media and stats
+    # row's version. drawn from catalog_version, so a recreated table doesn't reuse values
+    op.create_table(
+        "catalog_revision",
+        sa.Column("id", sa.Boolean, primary_key=True, server_default=sa.true()),
+        sa.Column(
+            "version",
+            sa.BigInteger,
+            nullable=False,
+            server_default=sa.text("nextval('catalog_version')"),
+        ),
+        sa.CheckConstraint("id", name="ck_catalog_revision_single_row"),
+    )
+
+    op.execute("INSERT INTO catalog_revision DEFAULT VALUES")
+
+    # media's own version only fed the old catalog ETag, rating stats keep theirs for review ETags
+    op.drop_column("media", "version")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column(
+        "media",
+        sa.Column(
+            "version",
+            sa.BigInteger,
+            nullable=False,
+            server_default=sa.text("nextval('catalog_version')"),
+        ),
+    )
+    op.drop_table("catalog_revision")
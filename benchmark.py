@@ -0,0 +1,578 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+import httpx
+import sqlalchemy
+
+from src import config
+from src import database as db
+from src.api import statements
+
+USERS = 10000
+MEDIA = 1000
+CONCURRENCY = 10
+DURATION = 10.0
+WARMUP = 1.0
+TOLERANCE = 10.0
+QUANTILES = {"p50_ms": 0.5, "p95_ms": 0.95, "p99_ms": 0.99}
+
+# Run against a server using the same database, seeding it first:
+#   python main.py
+#   python benchmark.py --url http://localhost:3000 --users 100000 --seed 42 --output results.json
+# then measure a change against those numbers:
+#   python benchmark.py --url http://localhost:3000 --users 100000 --seed 42 --output after.json --baseline results.json
+
+
+# ---------------- scenarios ----------------
+# every route in users.py and media.py, requests are built from the rows populate.py generates:
+# user1..userN, show1..show{M/2} and movie{M/2+1}..movie{M}
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    route: str
+    # (rng, n) -> (path, keyword arguments for httpx), n counts requests so writes can make unique names
+    build: Callable[[random.Random, int], tuple]
+    # other statuses count as errors, 404s and 409s are expected where the random data can miss
+    expected: tuple = (200,)
+
+
+class Data:
+    """
+    Picks random rows out of the populated dataset
+    """
+
+    def __init__(self, users: int, media: int, run: int):
+        self.users = users
+        self.media = media
+        self.run = run
+
+    def user(self, rng: random.Random) -> str:
+        return f"user{rng.randint(1, self.users)}"
+
+    def title(self, rng: random.Random) -> str:
+        media_id = rng.randint(1, self.media)
+        return f"show{media_id}" if media_id <= self.media // 2 else f"movie{media_id}"
+
+    def unique(self, prefix: str, n: int) -> str:
+        # alphanumeric, so it also passes as a username
+        return f"{prefix}{self.run}x{n}"
+
+
+def scenarios(data: Data, api_key: str | None) -> list[Scenario]:
+    def review_rows(rng: random.Random) -> bytes:
+        rows = [
+            {
+                "username": data.user(rng),
+                "title": data.title(rng),
+                "rating": rng.randint(1, 5),
+                "review": "benchmark",
+            }
+            for _ in range(100)
+        ]
+        return "\n".join(json.dumps(row) for row in rows).encode()
+
+    return [
+        # users
+        Scenario(
+            "view_user",
+            "GET",
+            "/users/{username}",
+            lambda rng, n: (f"/users/{data.user(rng)}", {}),
+        ),
+        Scenario(
+            "get_watchlist",
+            "GET",
+            "/users/{username}/watchlist",
+            lambda rng, n: (
+                f"/users/{data.user(rng)}/watchlist",
+                {"params": {"only_watched_media": rng.choice([True, False])}},
+            ),
+        ),
+        Scenario(
+            "get_watchlist_summary",
+            "GET",
+            "/users/{username}/watchlist/summary",
+            lambda rng, n: (f"/users/{data.user(rng)}/watchlist/summary", {}),
+        ),
+        Scenario(
+            "search_users",
+            "GET",
+            "/users/search",
+            lambda rng, n: (
+                "/users/search",
+                {"params": {"username": f"user{rng.randint(1, 999)}"}},
+            ),
+            (200, 404),
+        ),
+        Scenario(
+            "get_followers",
+            "GET",
+            "/users/{username}/followers",
+            lambda rng, n: (f"/users/{data.user(rng)}/followers", {}),
+        ),
+        Scenario(
+            "get_suggested_friends",
+            "GET",
+            "/users/{username}/suggested_friends",
+            lambda rng, n: (
+                f"/users/{data.user(rng)}/suggested_friends",
+                {"params": {"min_mutual": 1}},
+            ),
+            (200, 404),
+        ),
+        Scenario(
+            "create_new_user",
+            "POST",
+            "/users/{username}",
+            lambda rng, n: (f"/users/{data.unique('bench', n)}", {}),
+            (204,),
+        ),
+        Scenario(
+            "add_to_watchlist",
+            "POST",
+            "/users/{username}/watchlist",
+            lambda rng, n: (
+                f"/users/{data.user(rng)}/watchlist",
+                {"params": {"title": data.title(rng), "have_watched": False}},
+            ),
+            (204, 409),
+        ),
+        Scenario(
+            "add_to_watchlist_bulk",
+            "POST",
+            "/users/{username}/watchlist/bulk",
+            lambda rng, n: (
+                f"/users/{data.user(rng)}/watchlist/bulk",
+                {"json": [{"title": data.title(rng)} for _ in range(10)]},
+            ),
+        ),
+        Scenario(
+            "mark_as_watched",
+            "PATCH",
+            "/users/{username}/watchlist/{media_title}",
+            lambda rng, n: (f"/users/{data.user(rng)}/watchlist/{data.title(rng)}", {}),
+            (204, 404),
+        ),
+        Scenario(
+            "add_friend",
+            "POST",
+            "/users/{username}/friends",
+            lambda rng, n: (
+                f"/users/{data.user(rng)}/friends",
+                {"json": {"username": data.user(rng)}},
+            ),
+            (204, 400, 409),
+        ),
+        Scenario(
+            "remove_friend",
+            "DELETE",
+            "/users/{username}/friends/{friend_username}",
+            lambda rng, n: (f"/users/{data.user(rng)}/friends/{data.user(rng)}", {}),
+            (204, 404),
+        ),
+        # media
+        Scenario(
+            "search_media",
+            "GET",
+            "/media/search",
+            lambda rng, n: (
+                "/media/search",
+                {
+                    "params": {
+                        "media_name": f"show{rng.randint(1, 99)}",
+                        "media_type": "show",
+                    }
+                },
+            ),
+            (200, 404),
+        ),
+        Scenario(
+            "view_media",
+            "GET",
+            "/media/view",
+            lambda rng, n: (
+                "/media/view",
+                {"params": {"media_type": rng.choice(["movie", "show"])}},
+            ),
+        ),
+        Scenario(
+            "view_reviews",
+            "GET",
+            "/media/{media_title}/reviews",
+            lambda rng, n: (f"/media/{data.title(rng)}/reviews", {}),
+            (200, 404),
+        ),
+        Scenario(
+            "get_recommendations",
+            "GET",
+            "/media/{username}/recommendations",
+            lambda rng, n: (f"/media/{data.user(rng)}/recommendations", {}),
+        ),
+        Scenario(
+            "post_film",
+            "POST",
+            "/media/films",
+            lambda rng, n: (
+                "/media/films",
+                {
+                    "json": {
+                        "title": data.unique("film", n),
+                        "director": "benchmark",
+                        "length": 120,
+                    }
+                },
+            ),
+            (201,),
+        ),
+        Scenario(
+            "post_show",
+            "POST",
+            "/media/shows",
+            lambda rng, n: (
+                "/media/shows",
+                {
+                    "json": {
+                        "title": data.unique("series", n),
+                        "director": "benchmark",
+                        "seasons": 2,
+                        "episodes": 20,
+                    }
+                },
+            ),
+            (201,),
+        ),
+        Scenario(
+            "post_catalog_bulk",
+            "POST",
+            "/media/catalog/bulk",
+            lambda rng, n: (
+                "/media/catalog/bulk",
+                {
+                    "json": [
+                        {
+                            "title": data.unique(f"drop{i}", n),
+                            "director": "benchmark",
+                            "length": 100,
+                        }
+                        if i % 2
+                        else {
+                            "title": data.unique(f"drop{i}", n),
+                            "director": "benchmark",
+                            "seasons": 2,
+                            "episodes": 20,
+                        }
+                        for i in range(100)
+                    ],
+                    "headers": {"access_token": api_key or ""},
+                },
+            ),
+        ),
+        Scenario(
+            "review_media",
+            "POST",
+            "/media/{media_title}/reviews",
+            lambda rng, n: (
+                f"/media/{data.title(rng)}/reviews",
+                {
+                    "json": {
+                        "username": data.user(rng),
+                        "review": "benchmark",
+                        "rating": rng.randint(1, 5),
+                    }
+                },
+            ),
+            (201,),
+        ),
+        Scenario(
+            "review_media_bulk",
+            "POST",
+            "/media/reviews/bulk",
+            lambda rng, n: (
+                "/media/reviews/bulk",
+                {
+                    "content": review_rows(rng),
+                    "headers": {
+                        "content-type": "application/x-ndjson",
+                        "access_token": api_key or "",
+                    },
+                },
+            ),
+        ),
+    ]
+
+
+# ---------------- runner ----------------
+
+
+def percentile(latencies: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile of sorted latencies
+    """
+    return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    concurrency: int,
+    duration: float,
+    warmup: float,
+    seed: int,
+) -> dict:
+    """
+    Drive one route with concurrent virtual users, each sending its next request as soon as
+    the last one returns. Requests finishing during the warmup aren't recorded.
+    """
+    latencies = []
+    errors = 0
+    statuses: dict[str, int] = {}
+    counter = iter(range(sys.maxsize))
+    start = time.perf_counter()
+    measure_from = start + warmup
+    deadline = measure_from + duration
+
+    async def virtual_user(worker: int):
+        nonlocal errors
+        rng = random.Random(f"{seed}:{scenario.name}:{worker}")
+        while time.perf_counter() < deadline:
+            path, kwargs = scenario.build(rng, next(counter))
+            sent = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, path, **kwargs)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = None
+            finished = time.perf_counter()
+            if finished < measure_from:
+                continue
+
+            latencies.append(finished - sent)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status not in scenario.expected:
+                errors += 1
+
+    await asyncio.gather(*(virtual_user(worker) for worker in range(concurrency)))
+
+    latencies.sort()
+    result = {
+        "method": scenario.method,
+        "route": scenario.route,
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": statuses,
+        "throughput": round(len(latencies) / duration, 2),
+    }
+    for name, q in QUANTILES.items():
+        result[name] = round(percentile(latencies, q) * 1000, 2) if latencies else None
+    result["mean_ms"] = (
+        round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None
+    )
+    return result
+
+
+async def benchmark(
+    url: str | None,
+    routes: list[Scenario],
+    concurrency: int,
+    duration: float,
+    warmup: float,
+    seed: int,
+) -> dict:
+    async with AsyncExitStack() as stack:
+        transport: httpx.AsyncBaseTransport
+        if url:
+            transport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(max_connections=concurrency)
+            )
+            base_url = url
+        else:
+            # in-process, no server or network in the way - handy in CI, but the client shares the CPU.
+            # ASGITransport doesn't send lifespan events, so run startup and shutdown around the run
+            from src.api.server import app
+
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            transport = httpx.ASGITransport(app=app)
+            base_url = "http://benchmark"
+
+        results = {}
+        client = await stack.enter_async_context(
+            httpx.AsyncClient(transport=transport, base_url=base_url, timeout=30.0)
+        )
+        for scenario in routes:
+            results[scenario.name] = await run_scenario(
+                client, scenario, concurrency, duration, warmup, seed
+            )
+            print_result(scenario.name, results[scenario.name])
+    return results
+
+
+# ---------------- reporting ----------------
+
+
+def print_result(name: str, result: dict):
+    print(
+        f"{name:<24} {result['throughput']:>9.1f} req/s  p50 {result['p50_ms']}ms  "
+        f"p95 {result['p95_ms']}ms  p99 {result['p99_ms']}ms  errors {result['errors']}/{result['requests']}"
+    )
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Print the change from the baseline for every route in both runs, and return the routes
+    whose p95 got slower or throughput dropped by more than tolerance percent
+    """
+
+    def change(new, old):
+        return (new - old) / old * 100 if new is not None and old else 0.0
+
+    regressions = []
+    print(f"\n{'route':<24} {'throughput':>11} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, result in results["routes"].items():
+        old = baseline["routes"].get(name)
+        if old is None:
+            continue
+        throughput = change(result["throughput"], old["throughput"])
+        p50, p95, p99 = (
+            change(result[q], old[q]) for q in ("p50_ms", "p95_ms", "p99_ms")
+        )
+        regressed = p95 > tolerance or throughput < -tolerance
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:<24} {throughput:>+10.1f}% {p50:>+8.1f}% {p95:>+8.1f}% {p99:>+8.1f}%{'  REGRESSED' if regressed else ''}"
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test every users and media route and report throughput and latency percentiles"
+    )
+    parser.add_argument(
+        "--url",
+        default=None,
+        help="server to benchmark, e.g. http://localhost:3000 - runs the app in-process when left out",
+    )
+    parser.add_argument(
+        "--users",
+        type=int,
+        default=USERS,
+        help="number of users populate.py generates, and requests pick from",
+    )
+    parser.add_argument(
+        "--media",
+        type=int,
+        default=MEDIA,
+        help="number of media rows populate.py generates, and requests pick from",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="random seed for the dataset and the request mix",
+    )
+    parser.add_argument(
+        "--skip-populate",
+        action="store_true",
+        help="benchmark the data already in the database, generated with the same --users and --media",
+    )
+    parser.add_argument(
+        "--routes",
+        nargs="*",
+        default=None,
+        help="only run these scenarios, by handler name",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=CONCURRENCY, help="virtual users per route"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=DURATION, help="seconds measured per route"
+    )
+    parser.add_argument(
+        "--warmup",
+        type=float,
+        default=WARMUP,
+        help="seconds run per route before measuring",
+    )
+    parser.add_argument(
+        "--output", default=None, help="write the results to this JSON file"
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="compare against results written by an earlier run",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=TOLERANCE,
+        help="percent change in p95 or throughput reported as a regression, exits 1 if any route regresses",
+    )
+    args = parser.parse_args()
+
+    data = Data(args.users, args.media, run=int(time.time()) % 100000)
+    routes = scenarios(data, config.get_settings().API_KEY)
+    if args.routes:
+        unknown = set(args.routes) - {scenario.name for scenario in routes}
+        if unknown:
+            parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+        routes = [scenario for scenario in routes if scenario.name in args.routes]
+
+    if not args.skip_populate:
+        from populate import populate
+
+        print(f"Populating {args.users} users and {args.media} media rows")
+        populate(users=args.users, media=args.media, seed=args.seed)
+        # settle the freshly loaded tables now, rather than have autovacuum do it during the first routes
+        with db.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as connection:
+            connection.execute(
+                sqlalchemy.text(f"VACUUM (ANALYZE) {', '.join(statements.TABLES)}")
+            )
+
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "url": args.url or "in-process",
+            "users": args.users,
+            "media": args.media,
+            "seed": args.seed,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+        },
+        "routes": asyncio.run(
+            benchmark(
+                args.url,
+                routes,
+                args.concurrency,
+                args.duration,
+                args.warmup,
+                args.seed,
+            )
+        ),
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\nRegressed: {', '.join(regressions)}")
+            sys.exit(1)
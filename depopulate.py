@@ -1,33 +1,23 @@
-import sqlalchemy
-from src.api import auth
+from src.api import statements
+from src import cache
 from src import database as db
 
-def depopulate():
+
+def depopulate(rebuild: bool = False):
     """
-    Depopulate the database by dropping all tables.
+    Depopulate the database by truncating all tables in one statement.
+    With rebuild, derived aggregates and planner statistics are rebuilt afterwards.
     """
     with db.engine.begin() as connection:
-        connection.execute(
-            sqlalchemy.text("DELETE FROM watchlists")
-        )
-        connection.execute(
-            sqlalchemy.text("DELETE FROM reviews")
-        )
-        connection.execute(
-            sqlalchemy.text("DELETE FROM users")
-        )
-        connection.execute(
-            sqlalchemy.text("DELETE FROM tv_shows")
-        )
-        connection.execute(
-            sqlalchemy.text("DELETE FROM movies")
-        )
-        connection.execute(
-            sqlalchemy.text("DELETE FROM media")
-        )
-
+        for statement in statements.RESET:
+            connection.execute(statement)
+        if rebuild:
+            for statement in statements.REBUILD:
+                connection.execute(statement)
+        # running workers would keep serving pages of the old data until their TTL ran out
+        cache.clear_blocking(connection)
 
 
 if __name__ == "__main__":
     depopulate()
-    print("Database has been depopulated")
\ No newline at end of file
+    print("Database has been depopulated")
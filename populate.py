@@ -1,10 +1,15 @@
+import argparse
+import random
 import sqlalchemy
-from src.api import auth
+from itertools import islice
+from src import cache
 from src import database as db
+from src.api import statements
 from depopulate import depopulate
-import random
 
 SIZE = 100000
+MEDIA_SIZE = 1000
+CHUNK_SIZE = 50000
 # 100000 users
 # 5ish reviews per user
 # 5ish watchlists per user
@@ -15,144 +20,206 @@ SIZE = 100000
 # watchlists - 492483
 
 
-def populate():
+# ---------------- row generators ----------------
+# rows are generated lazily with explicit ids, so memory stays bounded
+# no matter how many users are requested
+
+
+def user_rows(users: int):
+    for i in range(1, users + 1):
+        yield (i, f"user{i}")
+
+
+def friendship_rows(rng: random.Random, users: int):
+    for i in range(1, users + 1):
+        friends = {rng.randint(1, users) for _ in range(rng.randint(0, 10))}
+        friends.discard(i)
+        for friend_id in sorted(friends):
+            yield (i, friend_id)
+
+
+def media_rows(media: int):
+    # first half shows, second half movies
+    shows = media // 2
+    for i in range(1, shows + 1):
+        yield (i, "show", f"show{i}", f"director{i}")
+    for i in range(shows + 1, media + 1):
+        yield (i, "movie", f"movie{i}", f"director{i}")
+
+
+def tv_show_rows(rng: random.Random, media: int):
+    for i in range(1, media // 2 + 1):
+        yield (i, rng.randint(1, 50), rng.randint(1, 10))
+
+
+def movie_rows(rng: random.Random, media: int):
+    for i in range(media // 2 + 1, media + 1):
+        yield (i, rng.randint(30, 230))
+
+
+def review_rows(rng: random.Random, users: int, media: int):
+    for i in range(1, users + 1):
+        media_ids = rng.sample(range(1, media + 1), min(rng.randint(0, 10), media))
+        for j, media_id in enumerate(sorted(media_ids)):
+            yield (i, media_id, rng.randint(1, 5), f"Review {j + 1} for user {i}")
+
+
+def watchlist_rows(rng: random.Random, users: int, media: int):
+    for i in range(1, users + 1):
+        media_ids = rng.sample(range(1, media + 1), min(rng.randint(0, 10), media))
+        for media_id in sorted(media_ids):
+            yield (i, media_id, rng.choice([True, False]))
+
+
+# ---------------- loaders ----------------
+
+
+def copy_rows(connection, table: str, columns: list[str], rows, chunk_size: int):
     """
-    Populate the database with 1 million rows
+    Stream rows into table with COPY FROM STDIN. Every row goes through one COPY
+    statement, chunk_size is only used by insert_rows.
     """
-    depopulate()  
+    with connection.connection.driver_connection.cursor() as cursor:
+        with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
 
-    with db.engine.begin() as connection:
-        # create users
-        users = []
-        for i in range(1, SIZE+1):
-            username = f'user{i}'
-            users.append({'username': username})
 
-        connection.execute(
-            sqlalchemy.text(
-                "INSERT INTO users (username) VALUES (:username)"
-            ),
-            users
+def insert_rows(connection, table: str, columns: list[str], rows, chunk_size: int):
+    """
+    Insert rows with executemany, chunk_size rows at a time
+    """
+    statement = sqlalchemy.text(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"
+    )
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        connection.execute(statement, [dict(zip(columns, row)) for row in chunk])
+
+
+LOADERS = {"copy": copy_rows, "insert": insert_rows}
+
+
+def populate(
+    users: int = SIZE,
+    media: int = MEDIA_SIZE,
+    seed: int | None = None,
+    loader: str = "copy",
+    chunk_size: int = CHUNK_SIZE,
+):
+    """
+    Populate the database with about 11 rows per user - 100,000 users gives about 1 million rows.
+    The same seed always generates the same data.
+    """
+    depopulate()
+
+    rng = random.Random(seed)
+    load = LOADERS[loader]
+
+    with db.engine.begin() as connection:
+        load(connection, "users", ["id", "username"], user_rows(users), chunk_size)
+        load(
+            connection,
+            "friendships",
+            ["user_id", "friend_id"],
+            friendship_rows(rng, users),
+            chunk_size,
         )
-        # add friends to users
-        min_id = connection.execute(
-            sqlalchemy.text("SELECT MIN(id) FROM users")
-        ).scalar()
-        max_id = connection.execute(
-            sqlalchemy.text("SELECT MAX(id) FROM users")
-        ).scalar()
-
-        friend_updates = []
-        for i in range(min_id, max_id + 1):
-            friends = []
-            for _ in range(random.randint(0, 10)):
-                friends.append(random.randint(min_id, max_id))
-            friends = list(set(friends))
-            if i in friends:
-                friends.remove(i)
-            friend_updates.append({"id": i, "friends": friends})
 
-        connection.execute(
-            sqlalchemy.text("UPDATE users SET friends = :friends WHERE id = :id"),
-            friend_updates
+        load(
+            connection,
+            "media",
+            ["media_id", "media_type", "title", "director"],
+            media_rows(media),
+            chunk_size,
+        )
+        load(
+            connection,
+            "tv_shows",
+            ["media_id", "total_episodes", "total_seasons"],
+            tv_show_rows(rng, media),
+            chunk_size,
+        )
+        load(
+            connection,
+            "movies",
+            ["media_id", "length"],
+            movie_rows(rng, media),
+            chunk_size,
         )
 
-        # create media
-        for i in range(1, 501):
-            title = f'show{i}'
-            director = f'director{i}'
-            connection.execute(
-                sqlalchemy.text(
-                    "INSERT INTO media (title, media_type, director) VALUES (:title, 'show', :director)"
-                ),
-                {"title": title, "director": director}
-            )
-        for i in range(501, 1001):
-            title = f'movie{i}'
-            director = f'director{i}'
-            connection.execute(
-                sqlalchemy.text(
-                    "INSERT INTO media (title, media_type, director) VALUES (:title, 'movie', :director)"
-                ),
-                {"title": title, "director": director}
-            )
-        
-        # create tv shows
-        show_min_id = connection.execute(
-            sqlalchemy.text("SELECT MIN(media_id) FROM media WHERE media_type = 'show'")
-        ).scalar()
-        show_max_id = connection.execute(
-            sqlalchemy.text("SELECT MAX(media_id) FROM media WHERE media_type = 'show'")
-        ).scalar()
-        movie_min_id = connection.execute(
-            sqlalchemy.text("SELECT MIN(media_id) FROM media WHERE media_type = 'movie'")
-        ).scalar()
-        movie_max_id = connection.execute(
-            sqlalchemy.text("SELECT MAX(media_id) FROM media WHERE media_type = 'movie'")
-        ).scalar()
-        
-
-        for i in range(show_min_id, show_max_id + 1):
-            total_episodes = random.randint(1, 50)
-            total_seasons = random.randint(1, 10)
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    INSERT INTO tv_shows (media_id, total_episodes, total_seasons)
-                    VALUES (:media_id, :total_episodes, :total_seasons)
-                    """
-                ),
-                {"media_id": i, "total_episodes": total_episodes, "total_seasons": total_seasons}
-            )
-        for i in range(movie_min_id, movie_max_id + 1):
-            length = random.randint(30, 230)
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    INSERT INTO movies (media_id, length)
-                    VALUES (:media_id, :length)
-                    """
-                ), 
-                {"media_id": i, "length": length}
-            )
-        
-        
-        # create reviews
-        review_update = []
-        for i in range(min_id, max_id + 1):
-            for j in range(random.randint(0, 10)):
-                review_update.append({
-                    "user_id": i,
-                    "media_id": random.randint(show_min_id, movie_max_id),
-                    "rating": random.randint(1, 5),
-                    "review": f'Review {j+1} for user {i}'
-                })
+        load(
+            connection,
+            "reviews",
+            ["user_id", "media_id", "rating", "review"],
+            review_rows(rng, users, media),
+            chunk_size,
+        )
+        load(
+            connection,
+            "watchlists",
+            ["user_id", "media_id", "have_watched"],
+            watchlist_rows(rng, users, media),
+            chunk_size,
+        )
 
+        # ids were generated explicitly, move the sequences past them
         connection.execute(
-            sqlalchemy.text("INSERT INTO reviews (user_id, media_id, rating, review) VALUES (:user_id, :media_id, :rating, :review) ON CONFLICT DO NOTHING"),
-            review_update
+            sqlalchemy.text(
+                "SELECT setval(pg_get_serial_sequence('users', 'id'), :users)"
+            ),
+            {"users": max(users, 1)},
         )
-        
-        # create watchlists
-        watchlist_update = []
-        for i in range(min_id, max_id + 1):
-            for j in range(random.randint(0, 10)):
-                watchlist_update.append({
-                    "user_id": i,
-                    "media_id": random.randint(show_min_id, movie_max_id),
-                    "have_watched": random.choice([True, False])
-                })
-
         connection.execute(
-            sqlalchemy.text("""
-                INSERT INTO watchlists (user_id, media_id, have_watched)
-                VALUES (:user_id, :media_id, :have_watched)
-                ON CONFLICT DO NOTHING
-            """),
-            watchlist_update
+            sqlalchemy.text(
+                "SELECT setval(pg_get_serial_sequence('media', 'media_id'), :media)"
+            ),
+            {"media": max(media, 1)},
         )
 
+        # build per-media rating totals and planner statistics for the new data
+        for statement in statements.REBUILD:
+            connection.execute(statement)
+
+        # depopulate cleared the caches, but running workers may have cached the empty tables since
+        cache.clear_blocking(connection)
+
 
 if __name__ == "__main__":
-    populate()
-    print("Database has been populated")
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description="Populate the database with generated data"
+    )
+    parser.add_argument(
+        "--users", type=int, default=SIZE, help="number of users to generate"
+    )
+    parser.add_argument(
+        "--media",
+        type=int,
+        default=MEDIA_SIZE,
+        help="number of media rows, half shows and half movies",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None, help="random seed, for reproducible datasets"
+    )
+    parser.add_argument(
+        "--loader",
+        choices=sorted(LOADERS),
+        default="copy",
+        help="copy streams rows with COPY FROM STDIN, insert uses batched executemany",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help="rows per executemany batch, only used by --loader insert (copy sends every row in one COPY)",
+    )
+    args = parser.parse_args()
+
+    populate(
+        users=args.users,
+        media=args.media,
+        seed=args.seed,
+        loader=args.loader,
+        chunk_size=args.chunk_size,
+    )
+    print("Database has been populated")
@@ -1,7 +1,12 @@
+from datetime import datetime
 from fastapi import APIRouter, Depends, status, HTTPException
-import sqlalchemy
-from src.api import auth
+from pydantic import BaseModel
+from sqlalchemy.pool import QueuePool
+from typing import Any, List, Optional
+from src.api import auth, statements
 from src import database as db
+from src import cache
+from src import slow_queries
 
 router = APIRouter(
     prefix="/admin",
@@ -10,57 +15,153 @@ router = APIRouter(
 )
 
 
+class PoolStatus(BaseModel):
+    engine: str  # async or sync, whichever the route handlers are using
+    pool: str  # pool class, the counts below are None for pools that don't keep them
+    pool_size: Optional[int]
+    checked_out: Optional[int]
+    idle: Optional[int]
+    overflow: Optional[int]  # connections open beyond pool_size
+    checkouts: int
+    average_checkout_wait_ms: float
+    max_checkout_wait_ms: float
+
+
+class CacheStatus(BaseModel):
+    enabled: bool
+    backend: str  # memory, sqlite or redis
+    entries: Optional[int]  # None if the backend can't count them cheaply
+    max_entries: int
+    ttl_seconds: float
+    hits: int
+    misses: int
+    hit_rate: float
+    evictions: int  # dropped to stay under max_entries
+    expirations: int  # dropped because they outlived the ttl
+    invalidations: int  # dropped by writes
+
+
+class SlowQueryInfo(BaseModel):
+    statement: str
+    parameters: Any  # redacted, the first set for executemany
+    rows: int  # parameter sets run at once
+    duration_ms: float
+    route: str  # method and route template, or background outside a request
+    recorded_at: datetime
+    plan: Optional[str]  # None until explained, or if SLOW_QUERY_EXPLAIN is off
+
+
 @router.post("/reset", status_code=status.HTTP_204_NO_CONTENT)
-def reset():
+async def reset(rebuild: bool = False):
     """
-    Reset DB, clear all users and media
+    Reset DB, clear all users and media.
+    With rebuild, derived aggregates and planner statistics are rebuilt afterwards.
     """
 
     # clear all data in the database
     print("Resetting state...")
     try:
-        with db.engine.begin() as connection:
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    DELETE FROM users         
-                    """
-                ) 
-            )
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    DELETE FROM media         
-                    """
-                ) 
-            )
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    DELETE FROM movies         
-                    """
-                ) 
-            )
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    DELETE FROM reviews         
-                    """
-                ) 
-            )
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    DELETE FROM tv_shows         
-                    """
-                ) 
-            )
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    DELETE FROM watchlists         
-                    """
-                ) 
-            )
+        async with db.begin() as connection:
+            for statement in statements.RESET:
+                await connection.execute(statement)
+            if rebuild:
+                for statement in statements.REBUILD:
+                    await connection.execute(statement)
+            await cache.clear(connection)
     except Exception as e:
-        raise HTTPException(status_code = 500,detail = "Could not reset")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Could not reset")
+
+
+@router.get("/pool", response_model=PoolStatus)
+async def pool_status():
+    """
+    Report connection pool usage and how long handlers waited for a connection
+    """
+    pool = db.async_engine.pool if db.settings.DB_ASYNC else db.engine.pool
+    stats = db.pool_stats
+
+    # only QueuePool (and the async engine's subclass of it) counts its connections,
+    # NullPool or StaticPool set through engine options have nothing to report
+    queue_pool = pool if isinstance(pool, QueuePool) else None
+
+    return PoolStatus(
+        engine="async" if db.settings.DB_ASYNC else "sync",
+        pool=type(pool).__name__,
+        pool_size=queue_pool.size() if queue_pool else None,
+        checked_out=queue_pool.checkedout() if queue_pool else None,
+        idle=queue_pool.checkedin() if queue_pool else None,
+        overflow=max(queue_pool.overflow(), 0) if queue_pool else None,
+        checkouts=stats.checkouts,
+        average_checkout_wait_ms=stats.total_wait / stats.checkouts * 1000
+        if stats.checkouts
+        else 0,
+        max_checkout_wait_ms=stats.max_wait * 1000,
+    )
+
+
+@router.get("/cache", response_model=CacheStatus)
+async def cache_status():
+    """
+    Report hit, miss and eviction counts for the read endpoint cache, counted per worker
+    """
+    stats = cache.cache
+    lookups = stats.hits + stats.misses
+
+    return CacheStatus(
+        enabled=cache.settings.CACHE_ENABLED,
+        backend=stats.name,
+        entries=await cache.call(stats.size),
+        max_entries=stats.max_entries,
+        ttl_seconds=stats.ttl,
+        hits=stats.hits,
+        misses=stats.misses,
+        hit_rate=stats.hits / lookups if lookups else 0,
+        evictions=stats.evictions,
+        expirations=stats.expirations,
+        invalidations=stats.invalidations,
+    )
+
+
+@router.get("/slow_queries", response_model=List[SlowQueryInfo])
+async def get_slow_queries(
+    order: str = "recent", route: Optional[str] = None, limit: int = 50
+):
+    """
+    Browse the statements that went over SLOW_QUERY_MS in this worker, most recent or slowest first,
+    optionally for one route (e.g. GET /users/search)
+    """
+    if order not in ("recent", "slowest"):
+        raise HTTPException(
+            status_code=400, detail="Order must be either 'recent' or 'slowest'."
+        )
+    if limit < 1 or limit > 1000:
+        raise HTTPException(status_code=400, detail="Limit must be between 1 and 1000.")
+
+    entries = [
+        entry
+        for entry in reversed(slow_queries.log.entries)
+        if route is None or entry.route == route
+    ]
+    if order == "slowest":
+        entries.sort(key=lambda entry: entry.duration, reverse=True)
+
+    return [
+        SlowQueryInfo(
+            statement=entry.statement,
+            parameters=entry.parameters,
+            rows=entry.rows,
+            duration_ms=entry.duration * 1000,
+            route=entry.route,
+            recorded_at=entry.recorded_at,
+            plan=entry.plan,
+        )
+        for entry in entries[:limit]
+    ]
+
+
+@router.delete("/slow_queries", status_code=status.HTTP_204_NO_CONTENT)
+async def clear_slow_queries():
+    """
+    Empty the slow query log, e.g. before measuring a change
+    """
+    slow_queries.log.clear()
@@ -0,0 +1,73 @@
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import Response, status
+from pydantic import TypeAdapter
+
+from src import cache
+from src import database as db
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Build an ETag from the version of the data and the request parameters that shaped the body.
+    Weak, since gzipped and plain responses share it.
+    """
+    digest = hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against the current ETag, weak comparison as RFC 9110 asks for
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag.removeprefix("W/")
+        for tag in if_none_match.split(",")
+    )
+
+
+def not_modified(etag: str) -> Response:
+    """
+    304 response for a client that already has the current representation, no body to serialize
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+async def conditional_read(
+    response: Response,
+    if_none_match: Optional[str],
+    name: str,
+    tag: str,
+    request: dict,
+    adapter: TypeAdapter,
+    version: Callable[[Any], Awaitable[Any]],
+    read: Callable[[Any], Awaitable[Any]],
+):
+    """
+    Serve a read that carries an ETag. Cached bodies are kept with their ETag, so polling
+    clients get a 304 without touching the database. On a miss version(connection) is
+    checked first and read(connection) only runs for a client that doesn't have it.
+    The body is cached under tag as an (etag, body) pair, adapter is that pair's type.
+    """
+    key = cache.make_key(name, request)
+    hit, cached = await cache.get(key, adapter)
+    if hit:
+        etag, body = cached
+    else:
+        async with db.begin() as connection:
+            etag = make_etag(tag, await version(connection), request)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+            body = await read(connection)
+        await cache.put(tag, key, (etag, body), adapter)
+
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return body
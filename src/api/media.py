@@ -1,11 +1,31 @@
 from dataclasses import dataclass
-from fastapi import APIRouter, Depends, status, HTTPException, Query
-from pydantic import BaseModel, Field, field_validator
-from typing import List, Optional
-
-import sqlalchemy
-from src.api import auth
+from fastapi import (
+    APIRouter,
+    Depends,
+    status,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, field_validator
+from typing import Annotated, AsyncIterator, List, Optional
+import json
+import psycopg
+import re
+
+from src.api import auth, statements
+from src.api.pagination import (
+    Page,
+    DEFAULT_LIMIT,
+    check_limit,
+    decode_cursor,
+    split_page,
+)
+from src.api.conditional import conditional_read
 from src import database as db
+from src import cache
 
 
 router = APIRouter(
@@ -13,11 +33,12 @@ router = APIRouter(
     tags=["media"],
 )
 
+
 class MediaInfo(BaseModel):
-    id : int
-    title : str
-    average_rating : float # average rating must be between 0 and 5 inclusive
-    director : str
+    id: int
+    title: str
+    average_rating: float  # average rating must be between 0 and 5 inclusive
+    director: str
 
     @field_validator("average_rating")
     @classmethod
@@ -26,6 +47,7 @@ class MediaInfo(BaseModel):
             raise ValueError("Average rating must be between 0 and 5.")
         return r
 
+
 class MediaType(BaseModel):
     title: str
     media_type: str
@@ -38,15 +60,42 @@ class MediaType(BaseModel):
             raise ValueError("Media type must be either 'movie' or 'show'.")
         return s
 
+
 class MediaReview(BaseModel):
     username: str
     review: str
-    rating: float = Field(..., gt=0, lt=6) # review must be between 1 and 5 inclusive
+    rating: float = Field(..., gt=0, lt=6)  # review must be between 1 and 5 inclusive
+
+
+# cached catalog and review pages, (etag, page)
+CACHED_MEDIA_PAGE = TypeAdapter(tuple[str, Page[MediaInfo]])
+CACHED_REVIEWS_PAGE = TypeAdapter(tuple[str, Page[MediaReview]])
+
+
+class RejectedReview(BaseModel):
+    row: int  # 1-based line number in an NDJSON upload, blank lines included, or data row of a CSV upload after the header
+    username: Optional[str]
+    title: Optional[str]
+    reason: str
+
+
+class ReviewImportResult(BaseModel):
+    received: int
+    merged: int
+    rejected_count: int
+    rejected: List[RejectedReview]  # first MAX_REJECTED_REVIEWS rejected rows
+
+
+MAX_REJECTED_REVIEWS = 1000
+REVIEW_IMPORT_FIELDS = ("username", "title", "rating", "review")
+
 
 class MediaRecommendation(BaseModel):
     id: int
     title: str
     media_type: str
+    friend_count: int  # number of friends with this title on their watchlist
+    score: float  # friend_count, with friends' average rating as a tie-breaker
 
     # media type must be movie or show
     @field_validator("media_type")
@@ -56,336 +105,641 @@ class MediaRecommendation(BaseModel):
             raise ValueError("Media type must be either 'movie' or 'show'.")
         return s
 
+
 class FilmSubmission(BaseModel):
-    title: str = Field(..., min_length=1, max_length=100) 
-    director: str = Field(..., min_length=1, max_length=100) 
+    title: str = Field(..., min_length=1, max_length=100)
+    director: str = Field(..., min_length=1, max_length=100)
     length: int = Field(..., gt=0, lt=1000)
 
+
 class ShowSubmission(BaseModel):
     title: str = Field(..., min_length=1, max_length=100)
-    director: str = Field(..., min_length=1, max_length=100) 
+    director: str = Field(..., min_length=1, max_length=100)
     seasons: int = Field(..., gt=0, lt=100)
     episodes: int = Field(..., gt=0, lt=1000)
 
 
+class RejectedTitle(BaseModel):
+    row: int  # 1-based position in a JSON list, or line number in an NDJSON upload with blank lines included
+    title: Optional[str]
+    reason: str
+
+
+class CatalogImportResult(BaseModel):
+    received: int
+    inserted: int
+    rejected_count: int
+    rejected: List[RejectedTitle]  # first MAX_REJECTED_TITLES rejected rows
 
-# search media
+
+MAX_CATALOG_ITEMS = 10000
+# about 1KB a title, the body is refused past this before any of it is parsed
+MAX_CATALOG_BYTES = 10 * 1024 * 1024
+MAX_REJECTED_TITLES = 1000
+
+
+# search media - substring match served by the title trigram index, most similar titles first
 @router.get("/search", response_model=List[str])
-def search_media(media_name: str, media_type: str):
-    with db.engine.begin() as connection:
-        search_results = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT title
-                FROM media
-                WHERE title LIKE :media_name AND media_type = :media_type
-                """
-            ),
-            [{"media_name": '%' + media_name + '%', "media_type": media_type}]  # Corrected parameter passing
+async def search_media(media_name: str, media_type: str):
+    async with db.begin() as connection:
+        search_results = (
+            await connection.execute(
+                statements.SEARCH_MEDIA,
+                [
+                    {
+                        "pattern": "%" + media_name + "%",
+                        "media_name": media_name,
+                        "media_type": media_type,
+                    }
+                ],
+            )
         ).fetchall()
-        
+
         if not search_results:  # Use `not search_results` to check for empty results
             raise HTTPException(status_code=404, detail="Media not found")
-        
+
         # Extract titles from the result set
         return [row.title for row in search_results]
 
 
 # view media
-@router.get("/view", response_model=List[MediaInfo])
-def view_media(media_title: Optional[str] = None,
-               director: Optional[str] = None,
-               media_type: Optional[str] = None):
-    
-    filters = []
-    parameters = {}
-    
-    if media_title:
-        filters.append("media.title ILIKE :media_title")
-        parameters['media_title'] = f'%{media_title}%'
-    if media_type:
-        filters.append("media.media_type = :media_type")
-        parameters['media_type'] = media_type.lower()
-
-    if director:
-        filters.append("media.director ILIKE :director")
-        parameters['director'] = f'%{director}%'
-
-    filter_string = ""
-    if filters:
-        filter_string = "WHERE " + " AND ".join(filters)
-    
-    query = f"""
-        WITH avgs AS (
-            SELECT media_id, AVG(rating) as avg_rev
-            FROM reviews
-            GROUP BY media_id
+@router.get("/view", response_model=Page[MediaInfo])
+async def view_media(
+    response: Response,
+    media_title: Optional[str] = None,
+    director: Optional[str] = None,
+    media_type: Optional[str] = None,
+    limit: int = DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+):
+    check_limit(limit)
+    # pages are ordered by rating, then media_id - start above the highest possible rating
+    after = decode_cursor(cursor, [(int, float), int]) or [float("inf"), 0]
+
+    # filters left as None are turned off, each combination has a statement of its own
+    filters = {
+        "media_title": f"%{media_title}%" if media_title else None,
+        "media_type": media_type.lower() if media_type else None,
+        "director": f"%{director}%" if director else None,
+    }
+    page_statement = statements.MEDIA_PAGES[
+        tuple(
+            name for name in statements.MEDIA_PAGE_FILTERS if filters[name] is not None
         )
-        SELECT media.media_id,media.title,COALESCE(avgs.avg_rev, 0) as average_rating, media.director
-        FROM media
-        LEFT JOIN avgs ON media.media_id = avgs.media_id
-        {filter_string}
-        ORDER BY average_rating DESC, media.title    
-    """
-    with db.engine.begin() as connection:
-        media = connection.execute(sqlalchemy.text(query),parameters)
-        
-        if not media:
-            raise HTTPException(status_code=404, detail="Media not found")
-        
+    ]
+    parameters = {
+        **{name: value for name, value in filters.items() if value is not None},
+        "after_rating": after[0],
+        "after_media_id": after[1],
+        "limit": limit + 1,
+    }
+
+    async def version(connection):
+        return (await connection.execute(statements.CATALOG_VERSION)).scalar_one()
+
+    async def read(connection):
+        media = (await connection.execute(page_statement, parameters)).fetchall()
+        media, next_cursor = split_page(
+            media, limit, lambda row: [row.average_rating, row.media_id]
+        )
+
         # Convert the result set to a list of MediaInfo objects
-        return [MediaInfo(id=row.media_id, title=row.title, average_rating=row.average_rating, director=row.director) for row in media]
+        return Page[MediaInfo](
+            items=[
+                MediaInfo(
+                    id=row.media_id,
+                    title=row.title,
+                    average_rating=row.average_rating,
+                    director=row.director,
+                )
+                for row in media
+            ],
+            next_cursor=next_cursor,
+        )
+
+    request = {
+        "media_title": media_title,
+        "director": director,
+        "media_type": media_type,
+        "limit": limit,
+        "cursor": cursor,
+    }
+    return await conditional_read(
+        response,
+        if_none_match,
+        "view_media",
+        "media:view",
+        request,
+        CACHED_MEDIA_PAGE,
+        version,
+        read,
+    )
+
+
+def title_rows(films: List[FilmSubmission], shows: List[ShowSubmission]) -> dict:
+    return {
+        "film_titles": [film.title for film in films],
+        "film_directors": [film.director for film in films],
+        "lengths": [film.length for film in films],
+        "show_titles": [show.title for show in shows],
+        "show_directors": [show.director for show in shows],
+        "seasons": [show.seasons for show in shows],
+        "episodes": [show.episodes for show in shows],
+    }
 
 
 # post film
-@router.post("/films", response_model=FilmSubmission, status_code=status.HTTP_201_CREATED)
-def post_film(film: FilmSubmission):
-    with db.engine.begin() as connection:
-        existing_media = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT media_id
-                FROM media
-                WHERE title = :title AND
-                media_type = 'movie'
-                """
-            ),[{'title':film.title,'director':film.director}]
+@router.post(
+    "/films", response_model=FilmSubmission, status_code=status.HTTP_201_CREATED
+)
+async def post_film(film: FilmSubmission):
+    async with db.begin() as connection:
+        # before the insert, which holds the catalog version until commit - a duplicate
+        # rolls back the notification, and only costs this worker its cached pages
+        await cache.invalidate(connection, "media:view")
+        # insert into media and movies in one round trip, nothing is returned for an existing title
+        inserted = (
+            await connection.execute(statements.INSERT_TITLES, [title_rows([film], [])])
         ).fetchone()
-        if existing_media:
-            raise HTTPException(status_code=409, detail="Movie already exists in database. Please try again")
-        else: 
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    INSERT INTO media (media_type,title,director)
-                    VALUES ('movie',:title,:director)
-                    RETURNING media_id
-                    """
-                ),[{'title':film.title,'director':film.director}]
-            )
-            # get the media_id of the newly inserted movie
-            media_id = connection.execute(
-                sqlalchemy.text(
-                    """
-                    SELECT media_id
-                    FROM media
-                    WHERE title = :title AND
-                    director = :director AND
-                    media_type = 'movie'
-                    """
-                ),[{'title':film.title,'director':film.director}]
-            ).one().media_id
-
-            # insert into movies table
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    INSERT INTO movies (media_id,length)
-                    VALUES (:media_id,:length)
-                    """
-                ),[{'media_id':media_id,'length':film.length}]
+        if not inserted:
+            raise HTTPException(
+                status_code=409,
+                detail="Movie already exists in database. Please try again",
             )
     return film
 
 
 # post show
-@router.post("/shows", response_model=ShowSubmission, status_code=status.HTTP_201_CREATED)
-def post_show(show: ShowSubmission):
-    with db.engine.begin() as connection:
-        existing_media = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT media_id
-                FROM media
-                WHERE 
-                title = :title AND
-                director = :director AND
-                media_type = 'show'
-                """
-            ),[{'title':show.title,'director':show.director}]
+@router.post(
+    "/shows", response_model=ShowSubmission, status_code=status.HTTP_201_CREATED
+)
+async def post_show(show: ShowSubmission):
+    async with db.begin() as connection:
+        # before the insert, like post_film
+        await cache.invalidate(connection, "media:view")
+        # insert into media and tv_shows in one round trip, nothing is returned for an existing title
+        inserted = (
+            await connection.execute(statements.INSERT_TITLES, [title_rows([], [show])])
         ).fetchone()
-        if existing_media:
-            raise HTTPException(status_code=409, detail="Show already exists in database. Please try again")
-        else: 
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    INSERT INTO media (media_type,title,director)
-                    VALUES ('show',:title,:director)
-                    RETURNING media_id
-                    """
-                ),[{'title':show.title,'director':show.director}]
-            )
-            # get the media_id of the newly inserted show
-            media_id = connection.execute(
-                sqlalchemy.text(
-                    """
-                    SELECT media_id
-                    FROM media
-                    WHERE title = :title AND
-                    director = :director AND
-                    media_type = 'show'
-                    """
-                ),[{'title':show.title,'director':show.director}]
-            ).one().media_id
-            # insert into shows table
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    INSERT INTO tv_shows (media_id,total_episodes,total_seasons)
-                    VALUES (:media_id,:total_episodes,:total_seasons)
-                    """
-                ),[{'media_id':media_id,'total_episodes':show.episodes,'total_seasons':show.seasons}]
+        if not inserted:
+            raise HTTPException(
+                status_code=409,
+                detail="Show already exists in database. Please try again",
             )
     return show
 
 
 # review media
-@router.post("/{media_title}/reviews", response_model=MediaReview, status_code=status.HTTP_201_CREATED)
-def review_media(media_title: str, review: MediaReview):
-    with db.engine.begin() as connection:
-        user_id = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT id
-                FROM users
-                WHERE username = :username
-                """
-            ), [{"username":review.username}]
+@router.post(
+    "/{media_title}/reviews",
+    response_model=MediaReview,
+    status_code=status.HTTP_201_CREATED,
+)
+async def review_media(media_title: str, review: MediaReview):
+    async with db.begin() as connection:
+        user_id = (
+            await connection.execute(
+                statements.USER_ID, [{"username": review.username}]
+            )
         ).scalar()
 
         if not user_id:
             raise HTTPException(status_code=404, detail="User not found")
 
-        media_id = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT media_id
-                FROM media
-                WHERE title ILIKE :media_title
-                LIMIT 1
-                """
-            ), [{"media_title": media_title}]).scalar_one()
-        
-        if not media_id:
+        # locks the title, so the totals below are adjusted from its latest reviews
+        media = (
+            await connection.execute(
+                statements.REVIEWED_MEDIA, [{"media_title": media_title}]
+            )
+        ).first()
+
+        if media is None:
             raise HTTPException(status_code=404, detail="Media not found")
-        
-        connection.execute(
-            sqlalchemy.text(
-                """
-                INSERT INTO reviews (user_id, media_id, rating, review)
-                VALUES (:user_id, :media_id, :rating, :review)
-                ON CONFLICT (user_id, media_id)
-                DO UPDATE SET
-                rating = EXCLUDED.rating,
-                review = EXCLUDED.review
-                """
-            ), [{"user_id": user_id,"media_id": media_id,"rating":review.rating,"review":review.review}]
+
+        # the review list and every average rating page may have changed - invalidated before
+        # the upsert, which holds the catalog version until commit
+        await cache.invalidate(connection, "media:view", f"reviews:{media.title}")
+
+        # upsert the review and apply the change to the media's rating totals -
+        # a replaced review only moves the sum by the difference in rating
+        await connection.execute(
+            statements.UPSERT_REVIEW,
+            [
+                {
+                    "user_id": user_id,
+                    "media_id": media.media_id,
+                    "rating": review.rating,
+                    "review": review.review,
+                }
+            ],
         )
     return review
 
+
+async def ndjson_lines(chunks: AsyncIterator[bytes]):
+    """
+    Split an NDJSON body into its non-blank lines as it arrives, each with its
+    1-based line number - blank lines are skipped but still counted, so numbers
+    match the line numbers the client sees in its file
+    """
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    if buffer.strip():
+        yield line_number + 1, buffer
+
+
+def ndjson_object(line: bytes) -> dict:
+    try:
+        row = json.loads(line)
+    except ValueError:
+        row = None
+    if not isinstance(row, dict):
+        raise ValueError("invalid JSON")
+    return row
+
+
+async def ndjson_review_rows(request: Request):
+    """
+    Parse an NDJSON body into staging rows as it arrives - (row_number, username, title, rating, review, error)
+    """
+    async for line_number, line in ndjson_lines(request.stream()):
+        try:
+            row = ndjson_object(line)
+        except ValueError:
+            yield (line_number, None, None, None, None, "invalid JSON")
+            continue
+        values = tuple(
+            None if row.get(field) is None else str(row[field])
+            for field in REVIEW_IMPORT_FIELDS
+        )
+        # postgres text can't hold NUL, COPY would refuse the whole body over it
+        if any(value is not None and "\x00" in value for value in values):
+            yield (line_number,) + values[:2] + (None, None, "contains a NUL character")
+            continue
+        yield (line_number,) + values + (None,)
+
+
+def copy_error(e: psycopg.errors.DataError) -> str:
+    """
+    Which line of the input COPY refused and why, e.g. "line 3: extra data after last expected column".
+    Lines are counted from 1, the CSV header included.
+    """
+    line = re.search(r"\bline (\d+)", e.diag.context or "")
+    reason = e.diag.message_primary or str(e)
+    return f"line {line.group(1)}: {reason}" if line else reason
+
+
+async def raw_body_chunks(request: Request):
+    async for chunk in request.stream():
+        if chunk:
+            yield chunk
+
+
+async def limited_body_chunks(request: Request, max_bytes: int):
+    """
+    Stream the body, refusing it with a 413 once it is known to be over max_bytes
+    """
+    too_large = HTTPException(
+        status_code=413, detail=f"Body cannot be larger than {max_bytes} bytes."
+    )
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_bytes:
+        raise too_large
+
+    received = 0
+    async for chunk in raw_body_chunks(request):
+        received += len(chunk)
+        if received > max_bytes:
+            raise too_large
+        yield chunk
+
+
+# bulk review ingestion for partner feeds
+@router.post(
+    "/reviews/bulk",
+    response_model=ReviewImportResult,
+    dependencies=[Depends(auth.get_api_key)],
+)
+async def review_media_bulk(request: Request):
+    """
+    Import reviews from an NDJSON body (application/x-ndjson, one
+    {"username", "title", "rating", "review"} object per line) or a CSV body
+    (text/csv, header row then username,title,rating,review). Rows are streamed
+    into a staging table with COPY, resolved with set-based joins and merged
+    into reviews with one upsert.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in ("application/x-ndjson", "text/csv"):
+        raise HTTPException(
+            status_code=415, detail="Body must be application/x-ndjson or text/csv"
+        )
+
+    async with db.begin() as connection:
+        await connection.execute(statements.CREATE_REVIEW_STAGING)
+
+        if content_type == "text/csv":
+            # let postgres parse the CSV as it streams in - a row it can't split into the
+            # four columns, or a NUL byte, fails the COPY and with it the whole body
+            try:
+                await db.copy_from(
+                    connection,
+                    "COPY review_staging (username, title, rating, review) FROM STDIN WITH (FORMAT csv, HEADER true)",
+                    raw_body_chunks(request),
+                )
+            except psycopg.errors.DataError as e:
+                raise HTTPException(
+                    status_code=400, detail=f"Malformed CSV, {copy_error(e)}"
+                )
+        else:
+            await db.copy_from(
+                connection,
+                "COPY review_staging (row_number, username, title, rating, review, error) FROM STDIN",
+                ndjson_review_rows(request),
+            )
+
+        # resolve usernames and titles
+        await connection.execute(statements.RESOLVE_STAGED_USERS)
+        await connection.execute(statements.RESOLVE_STAGED_MEDIA)
+
+        # reject rows that can't be merged
+        await connection.execute(statements.VALIDATE_STAGED_REVIEWS)
+
+        # the last valid row for a user and title wins
+        await connection.execute(statements.DEDUPE_STAGED_REVIEWS)
+
+        # every row's fate is settled, the merge below takes the ones without an error
+        counts = (await connection.execute(statements.STAGED_REVIEW_COUNTS)).one()
+
+        rejected = (
+            await connection.execute(
+                statements.REJECTED_STAGED_REVIEWS, [{"limit": MAX_REJECTED_REVIEWS}]
+            )
+        ).fetchall()
+
+        if counts.merged:
+            # a batch can touch any number of titles, drop everything rather than tracking them -
+            # before the merge, which holds the catalog version until commit
+            await cache.clear(connection)
+
+            # lock the batch's titles, so the merge below reads their latest reviews
+            await connection.execute(statements.LOCK_STAGED_MEDIA)
+
+            # merge into reviews and apply the change to each media's rating totals
+            await connection.execute(statements.MERGE_STAGED_REVIEWS)
+
+    return ReviewImportResult(
+        received=counts.received,
+        merged=counts.merged,
+        rejected_count=counts.received - counts.merged,
+        rejected=[
+            RejectedReview(
+                row=row.row_number,
+                username=row.username,
+                title=row.title,
+                reason=row.error,
+            )
+            for row in rejected
+        ],
+    )
+
+
+def catalog_submission(item) -> FilmSubmission | ShowSubmission:
+    """
+    Validate one catalog row - a film if it has a length, a show if it has seasons or episodes, never both
+    """
+    if not isinstance(item, dict):
+        raise ValueError("must be a JSON object")
+    is_film = "length" in item
+    is_show = "seasons" in item or "episodes" in item
+    model: type[FilmSubmission] | type[ShowSubmission]
+    if is_film and is_show:
+        raise ValueError(
+            "has both a length and seasons or episodes, can't tell a film from a show"
+        )
+    elif is_film:
+        model = FilmSubmission
+    elif is_show:
+        model = ShowSubmission
+    else:
+        raise ValueError("must have a length, or seasons and episodes")
+
+    try:
+        return model.model_validate(item)
+    except ValidationError as e:
+        error = e.errors()[0]
+        raise ValueError(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+        )
+
+
+# bulk catalog ingest for studio catalog drops
+@router.post(
+    "/catalog/bulk",
+    response_model=CatalogImportResult,
+    dependencies=[Depends(auth.get_api_key)],
+)
+async def post_catalog_bulk(request: Request):
+    """
+    Add films and shows from a JSON list (application/json) or an NDJSON body
+    (application/x-ndjson, one object per line), each shaped like a film or a show
+    submission, at most MAX_CATALOG_BYTES. Rows are validated together, then every film and show is
+    inserted with one statement. Titles already in the catalog, listed twice
+    or failing validation are reported back by row.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in ("application/json", "application/x-ndjson"):
+        raise HTTPException(
+            status_code=415,
+            detail="Body must be application/json or application/x-ndjson",
+        )
+
+    chunks = limited_body_chunks(request, MAX_CATALOG_BYTES)
+    items: list[tuple[int, object]]  # (row, JSON value or raw NDJSON line)
+    if content_type == "application/json":
+        try:
+            body = json.loads(b"".join([chunk async for chunk in chunks]))
+        except ValueError:
+            body = None
+        if not isinstance(body, list):
+            raise HTTPException(
+                status_code=400, detail="Body must be a JSON list of films and shows"
+            )
+        items = list(enumerate(body, start=1))
+    else:
+        items = []
+        async for line_number, line in ndjson_lines(chunks):
+            items.append((line_number, line))
+            if len(items) > MAX_CATALOG_ITEMS:
+                break
+
+    if len(items) > MAX_CATALOG_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot import more than {MAX_CATALOG_ITEMS} titles at once.",
+        )
+
+    films: list[tuple[int, FilmSubmission]] = []
+    shows: list[tuple[int, ShowSubmission]] = []
+    rejected: list[RejectedTitle] = []
+    seen: set[str] = set()
+    for row, item in items:
+        title = None
+        try:
+            if isinstance(item, bytes):
+                item = ndjson_object(item)
+            if isinstance(item, dict) and item.get("title") is not None:
+                title = str(item["title"])
+            submission = catalog_submission(item)
+        except ValueError as e:
+            rejected.append(RejectedTitle(row=row, title=title, reason=str(e)))
+            continue
+
+        # titles are unique across films and shows, the first row for a title wins
+        if submission.title in seen:
+            rejected.append(
+                RejectedTitle(
+                    row=row, title=title, reason="listed earlier in the upload"
+                )
+            )
+            continue
+        seen.add(submission.title)
+        if isinstance(submission, FilmSubmission):
+            films.append((row, submission))
+        else:
+            shows.append((row, submission))
+
+    inserted: set[str] = set()
+    async with db.begin() as connection:
+        if films or shows:
+            # before the insert, which holds the catalog version until commit - a body of
+            # titles that all exist already costs the cached pages for nothing
+            await cache.invalidate(connection, "media:view")
+            # titles already in the catalog come back missing from the inserted rows
+            inserted = {
+                row.title
+                for row in (
+                    await connection.execute(
+                        statements.INSERT_TITLES,
+                        [
+                            title_rows(
+                                [film for _, film in films], [show for _, show in shows]
+                            )
+                        ],
+                    )
+                ).fetchall()
+            }
+
+    for row, submission in films + shows:
+        if submission.title not in inserted:
+            rejected.append(
+                RejectedTitle(row=row, title=submission.title, reason="already exists")
+            )
+    rejected.sort(key=lambda rejection: rejection.row)
+
+    return CatalogImportResult(
+        received=len(items),
+        inserted=len(inserted),
+        rejected_count=len(rejected),
+        rejected=rejected[:MAX_REJECTED_TITLES],
+    )
+
+
 # view reviews
-@router.get("/{media_title}/reviews", response_model=List[MediaReview])
-def view_reviews(media_title: str):
-    with db.engine.begin() as connection:
-        reviews = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT username, rating, review
-                FROM reviews
-                JOIN users on reviews.user_id = users.id
-                JOIN media on reviews.media_id = media.media_id
-                WHERE title = :media_title
-                """
-            ), [{"media_title": media_title}]
+@router.get("/{media_title}/reviews", response_model=Page[MediaReview])
+async def view_reviews(
+    media_title: str,
+    response: Response,
+    limit: int = DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+):
+    check_limit(limit)
+    after = decode_cursor(cursor, [int]) or [0]
+
+    async def version(connection):
+        # every review write bumps the media's rating stats version
+        return (
+            await connection.execute(
+                statements.REVIEWS_VERSION, [{"media_title": media_title}]
+            )
+        ).scalar()
+
+    async def read(connection):
+        reviews = (
+            await connection.execute(
+                statements.REVIEWS_PAGE,
+                [
+                    {
+                        "media_title": media_title,
+                        "after_user_id": after[0],
+                        "limit": limit + 1,
+                    }
+                ],
+            )
         ).fetchall()
-        if not reviews:
+        if not reviews and cursor is None:
             raise HTTPException(status_code=404, detail="No reviews found")
-        return [MediaReview(username=row.username, rating=row.rating, review=row.review) for row in reviews]
-    pass
 
+        reviews, next_cursor = split_page(reviews, limit, lambda row: [row.user_id])
+        return Page[MediaReview](
+            items=[
+                MediaReview(username=row.username, rating=row.rating, review=row.review)
+                for row in reviews
+            ],
+            next_cursor=next_cursor,
+        )
 
+    request = {"media_title": media_title, "limit": limit, "cursor": cursor}
+    return await conditional_read(
+        response,
+        if_none_match,
+        "view_reviews",
+        f"reviews:{media_title}",
+        request,
+        CACHED_REVIEWS_PAGE,
+        version,
+        read,
+    )
 
 
 # COMPLEX ENDPOINT
 @router.get("/{username}/recommendations", response_model=List[MediaRecommendation])
-def get_recommendations(username: str):
-    with db.engine.begin() as connection:
+async def get_recommendations(username: str, limit: int = 10):
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code=400, detail="Limit must be between 1 and 100.")
+
+    async with db.begin() as connection:
         # get target user id
-        user_data = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT id, friends
-                FROM users
-                WHERE username = :username
-                """
-            ),
-            {"username": username}
-        ).fetchone()
+        user_id = (
+            await connection.execute(statements.USER_ID, {"username": username})
+        ).scalar()
 
-        if not user_data:
+        if not user_id:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user_id = user_data.id
-        friend_ids = user_data.friends
-
-        print(f'user id: {user_id} friend_ids: {friend_ids}')
-
-        if not friend_ids:
-            return []
-
-        # get target user watchlist
-        user_watchlist_media_ids = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT media_id
-                FROM watchlists
-                WHERE user_id = :user_id
-                """
-            ),
-            {"user_id": user_id}
+        # rank every title on a friend's watchlist that the user hasn't added yet,
+        # by how many friends have it and then by how those friends rated it
+        recommendations = (
+            await connection.execute(
+                statements.RECOMMENDATIONS, {"user_id": user_id, "limit": limit}
+            )
         ).fetchall()
-        
-
-        user_watchlist_media_ids = {row.media_id for row in user_watchlist_media_ids}
-
-        print(f'user watchlist media ids: {user_watchlist_media_ids}')
-
-        # fetch recommendations from friends' watchlists
-        recommendations = []
-        for friend_id in friend_ids:
-            friend_recommendations = connection.execute(
-                sqlalchemy.text(
-                    """
-                    SELECT DISTINCT m.media_id, m.title, m.media_type, m.director
-                    FROM watchlists w
-                    JOIN media m ON w.media_id = m.media_id
-                    WHERE w.user_id = :friend_id
-                      AND w.media_id NOT IN ( SELECT media_id
-                                                FROM watchlists
-                                                WHERE user_id = :user_id
-                                                ) 
-                    LIMIT 1
-                    """
-                ),
-                {"friend_id": friend_id, "user_id" : user_id}
-            ).fetchall()
-
-            recommendations.extend(friend_recommendations)
-
-            # stop if at 10 recommendations
-            if len(recommendations) >= 10:
-                break
-
-        print(f'recommendations: {recommendations}')
-
 
         return [
             MediaRecommendation(
                 id=row.media_id,
                 title=row.title,
                 media_type=row.media_type,
-                director=row.director
+                friend_count=row.friend_count,
+                score=row.score,
             )
-            for row in recommendations[:10] 
+            for row in recommendations
         ]
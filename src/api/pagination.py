@@ -0,0 +1,82 @@
+import base64
+import binascii
+import json
+from typing import Any, Generic, List, Optional, Sequence, Tuple, TypeVar
+
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = (
+        None  # pass back as ?cursor= to get the next page, None on the last page
+    )
+
+
+def check_limit(limit: int) -> None:
+    if limit < 1 or limit > MAX_LIMIT:
+        raise HTTPException(
+            status_code=400, detail=f"Limit must be between 1 and {MAX_LIMIT}."
+        )
+
+
+def encode_cursor(key: Sequence[Any]) -> str:
+    """
+    Encode the sort key of the last row on a page into an opaque cursor
+    """
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def decode_cursor(
+    cursor: Optional[str], types: Sequence[type | Tuple[type, ...]]
+) -> Optional[List[Any]]:
+    """
+    Decode a cursor back into the sort key it was made from, None if there is no cursor.
+    types are the key's element types in order - a key that doesn't match them is as
+    invalid as one that doesn't decode, it never gets as far as a bind parameter
+    """
+    if cursor is None:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if not isinstance(key, list) or len(key) != len(types):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    for value, expected in zip(key, types):
+        # JSON true is an int to isinstance, and postgres text can't hold NUL
+        if (
+            not isinstance(value, expected)
+            or isinstance(value, bool)
+            or (isinstance(value, str) and "\x00" in value)
+        ):
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return key
+
+
+def split_page(
+    rows: Sequence[Any], limit: int, key
+) -> Tuple[Sequence[Any], Optional[str]]:
+    """
+    Split rows fetched with LIMIT limit + 1 into the page and the cursor for the next one
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
+
+
+def trusted_page(items: List[dict], next_cursor: Optional[str]) -> ORJSONResponse:
+    """
+    Serialize a page straight to JSON with orjson, skipping per-item model validation.
+    Only for items built from database columns that already satisfy the item model,
+    e.g. usernames that were validated when the user was created.
+    """
+    return ORJSONResponse({"items": items, "next_cursor": next_cursor})
@@ -1,12 +1,26 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from src.api import users, media
+from fastapi.responses import PlainTextResponse
+from src.api import users, media, admin
+from src import cache
+from src import database as db
+from src import metrics
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 
 description = """
 Welcome to Nextlix!
 """
-tags_metadata = [
-    {"name": "users", "description": "Manage user accounts."}]
+tags_metadata = [{"name": "users", "description": "Manage user accounts."}]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # every worker applies the cache invalidations published by the others
+    listener = cache.start_listener(db.engine.url)
+    yield
+    if listener:
+        listener.stop()
 
 
 app = FastAPI(
@@ -19,6 +33,7 @@ app = FastAPI(
         "email": "nknievel@calpoly.edu",
     },
     openapi_tags=tags_metadata,
+    lifespan=lifespan,
 )
 
 origins = ["https://nextflix-mam5.onrender.com/"]
@@ -31,9 +46,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=db.settings.GZIP_MINIMUM_SIZE,
+    compresslevel=db.settings.GZIP_COMPRESS_LEVEL,
+)
+
+# outermost, so latency includes the other middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.include_router(users.router)
 app.include_router(media.router)
+app.include_router(admin.router)
+
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Nextflix!"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    """
+    Per-route latency, status codes, in-flight requests and database time in the
+    Prometheus text format, for this worker process
+    """
+    return PlainTextResponse(
+        metrics.metrics.render(), media_type="text/plain; version=0.0.4"
+    )
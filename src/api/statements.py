@@ -0,0 +1,669 @@
+import sqlalchemy
+
+# every statement the routers run, built once at import time. the text is identical on
+# every request, so psycopg's prepared statement cache (DB_PREPARE_THRESHOLD) lets
+# postgres skip parsing and planning when a connection runs a statement again
+
+
+# ---------------- users ----------------
+
+USERNAME_EXISTS = sqlalchemy.text(
+    """
+    SELECT username
+    FROM users
+    WHERE username = :username
+    """
+)
+
+INSERT_USER = sqlalchemy.text(
+    """
+    INSERT INTO users (username)
+    VALUES (:username)
+    """
+)
+
+USER_ID = sqlalchemy.text(
+    """
+    SELECT id FROM users
+    WHERE username = :username
+    """
+)
+
+MEDIA_ID_BY_TITLE = sqlalchemy.text(
+    """
+    SELECT media_id FROM media
+    WHERE title = :title
+    """
+)
+
+WATCHLIST_ENTRY = sqlalchemy.text(
+    """
+    SELECT * FROM watchlists
+    WHERE user_id = :user_id AND media_id = :media_id
+    """
+)
+
+INSERT_WATCHLIST_ENTRY = sqlalchemy.text(
+    """
+    INSERT INTO watchlists (user_id, media_id, have_watched)
+    VALUES (:user_id, :media_id, :have_watched)
+    """
+)
+
+MEDIA_IDS_BY_TITLES = sqlalchemy.text(
+    """
+    SELECT media_id, title FROM media
+    WHERE title = ANY(:titles)
+    """
+)
+
+INSERT_WATCHLIST_ENTRIES = sqlalchemy.text(
+    """
+    INSERT INTO watchlists (user_id, media_id, have_watched)
+    SELECT :user_id, new.media_id, new.have_watched
+    FROM unnest(CAST(:media_ids AS INTEGER[]), CAST(:have_watched AS BOOLEAN[]))
+        AS new(media_id, have_watched)
+    ON CONFLICT DO NOTHING
+    RETURNING media_id
+    """
+)
+
+WATCHLIST_ENTRY_BY_NAMES = sqlalchemy.text(
+    """
+    SELECT * FROM watchlists
+    WHERE user_id = (SELECT id FROM users WHERE username = :username)
+    AND media_id = (SELECT media_id FROM media WHERE title = :title)
+    """
+)
+
+MARK_AS_WATCHED = sqlalchemy.text(
+    """
+    UPDATE watchlists
+    SET have_watched = TRUE
+    WHERE user_id = (SELECT id FROM users WHERE username = :username)
+    AND media_id = (SELECT media_id FROM media WHERE title = :title)
+    """
+)
+
+WATCHLIST_PAGE = sqlalchemy.text(
+    """
+    SELECT watchlists.media_id, media.title, media.director, watchlists.have_watched
+    FROM watchlists
+    JOIN users ON watchlists.user_id = users.id
+    JOIN media ON watchlists.media_id = media.media_id
+    WHERE users.username = :username
+    AND watchlists.media_id > :after_media_id
+    ORDER BY watchlists.media_id
+    LIMIT :limit
+    """
+)
+
+# a statement of its own rather than a parameter, the planner can only pick the
+# partial ix_watchlists_user_id_media_id_watched index when have_watched is in the text
+WATCHED_WATCHLIST_PAGE = sqlalchemy.text(
+    """
+    SELECT watchlists.media_id, media.title, media.director, watchlists.have_watched
+    FROM watchlists
+    JOIN users ON watchlists.user_id = users.id
+    JOIN media ON watchlists.media_id = media.media_id
+    WHERE users.username = :username
+    AND watchlists.have_watched
+    AND watchlists.media_id > :after_media_id
+    ORDER BY watchlists.media_id
+    LIMIT :limit
+    """
+)
+
+USERNAMES_PAGE = sqlalchemy.text(
+    """
+    SELECT username
+    FROM users
+    WHERE username > :after_username
+    ORDER BY username
+    LIMIT :limit
+    """
+)
+
+USERNAME_SEARCH_PAGE = sqlalchemy.text(
+    """
+    SELECT username
+    FROM users
+    WHERE LOWER(username) LIKE LOWER(:username)
+    AND username > :after_username
+    ORDER BY username
+    LIMIT :limit
+    """
+)
+
+# the watchlist is counted from the primary key, once the user's id is known
+USER_PROFILE = sqlalchemy.text(
+    """
+    SELECT u.date_joined,
+           (SELECT COUNT(*) FROM watchlists AS w WHERE w.user_id = u.id) AS size_of_watchlist
+    FROM users AS u
+    WHERE u.username = :username
+    """
+)
+
+# no row for an unknown user, zero counts for an empty watchlist
+WATCHLIST_SUMMARY = sqlalchemy.text(
+    """
+    SELECT COUNT(w.media_id) AS total,
+           COUNT(*) FILTER (WHERE w.have_watched) AS watched
+    FROM users AS u
+    LEFT JOIN watchlists AS w ON w.user_id = u.id
+    WHERE u.username = :username
+    GROUP BY u.id
+    """
+)
+
+USER_IDS_BY_USERNAMES = sqlalchemy.text(
+    """
+    SELECT id, username
+    FROM users
+    WHERE username IN (:username, :friend_username)
+    """
+)
+
+INSERT_FRIENDSHIP = sqlalchemy.text(
+    """
+    INSERT INTO friendships (user_id, friend_id)
+    VALUES (:user_id, :friend_id)
+    ON CONFLICT DO NOTHING
+    RETURNING friend_id
+    """
+)
+
+DELETE_FRIENDSHIP = sqlalchemy.text(
+    """
+    DELETE FROM friendships
+    WHERE user_id = (SELECT id FROM users WHERE username = :username)
+    AND friend_id = (SELECT id FROM users WHERE username = :friend_username)
+    RETURNING friend_id
+    """
+)
+
+FOLLOWERS = sqlalchemy.text(
+    """
+    SELECT u.username
+    FROM friendships f
+    JOIN users u ON u.id = f.user_id
+    WHERE f.friend_id = :user_id
+    ORDER BY u.username
+    """
+)
+
+USER_ID_AND_HAS_FRIENDS = sqlalchemy.text(
+    """
+    SELECT id,
+           EXISTS (SELECT 1 FROM friendships WHERE user_id = users.id) AS has_friends
+    FROM users
+    WHERE username = :username
+    """
+)
+
+SUGGESTED_FRIENDS = sqlalchemy.text(
+    """
+    SELECT u.username, COUNT(*) AS mutual_friends
+    FROM friendships f
+    JOIN friendships ff ON ff.user_id = f.friend_id
+    JOIN users u ON u.id = ff.friend_id
+    WHERE f.user_id = :user_id
+      AND ff.friend_id <> :user_id
+      AND NOT EXISTS (
+          SELECT 1
+          FROM friendships mine
+          WHERE mine.user_id = :user_id
+            AND mine.friend_id = ff.friend_id
+      )
+    GROUP BY u.id, u.username
+    HAVING COUNT(*) >= :min_mutual
+    ORDER BY mutual_friends DESC, u.username
+    LIMIT :limit
+    """
+)
+
+
+# ---------------- media ----------------
+
+SEARCH_MEDIA = sqlalchemy.text(
+    """
+    SELECT title
+    FROM media
+    WHERE title ILIKE :pattern AND media_type = :media_type
+    ORDER BY similarity(title, :media_name) DESC, title
+    """
+)
+
+
+# version of everything view_media reads, one row - writers bump it before they commit
+CATALOG_VERSION = sqlalchemy.text(
+    """
+    SELECT version
+    FROM catalog_revision
+    """
+)
+
+
+# every transaction that changes media or rating stats bumps the version after its
+# writes - the catalog and review writes in the same statement, reset and rebuild with
+# this one. the row lock is held until commit, so versions are committed in the order
+# they are drawn and a reader never sees a version before the data it stands for.
+# every catalog writer queues on this one row, so handlers do their cache invalidation
+# before the bumping statement and only the commit happens while it's held
+BUMP_CATALOG_VERSION = sqlalchemy.text(
+    """
+    UPDATE catalog_revision
+    SET version = nextval('catalog_version')
+    """
+)
+
+
+# view_media's filters, in the order they make up a MEDIA_PAGES key
+MEDIA_PAGE_FILTERS = {
+    "media_title": "media.title ILIKE :media_title",
+    "media_type": "media.media_type = :media_type",
+    "director": "media.director ILIKE :director",
+}
+
+
+# pages go by rating, highest first, then media_id. rated titles are read in that order
+# from the stored average's index, titles nobody has reviewed yet (no stats row, rated 0)
+# from media's primary key - each branch stops after a page, and the outer sort merges them
+def media_page(filters: tuple[str, ...]) -> sqlalchemy.TextClause:
+    """
+    A view_media page with only the given filters in its text. Switching a filter off
+    with a NULL parameter instead leaves "parameter IS NULL OR ..." in the prepared
+    statement's generic plan, which can only be checked row by row - no index condition,
+    trigram or otherwise, can be taken from it.
+    """
+    where = "".join(
+        f"\n                AND {MEDIA_PAGE_FILTERS[name]}" for name in filters
+    )
+    return sqlalchemy.text(
+        f"""
+        SELECT media_id, title, average_rating, director
+        FROM (
+            (
+                SELECT media.media_id, media.title, stats.average_rating, media.director
+                FROM media_rating_stats AS stats
+                JOIN media ON media.media_id = stats.media_id
+                WHERE stats.average_rating <= :after_rating -- what the index scan can start from
+                AND (stats.average_rating < :after_rating OR stats.media_id > :after_media_id){where}
+                ORDER BY stats.average_rating DESC, stats.media_id
+                LIMIT :limit
+            )
+            UNION ALL
+            (
+                SELECT media.media_id, media.title, CAST(0 AS DOUBLE PRECISION), media.director
+                FROM media
+                WHERE NOT EXISTS (SELECT 1 FROM media_rating_stats AS stats WHERE stats.media_id = media.media_id)
+                AND (0 < :after_rating OR media.media_id > :after_media_id){where}
+                ORDER BY media.media_id
+                LIMIT :limit
+            )
+        ) AS page
+        ORDER BY average_rating DESC, media_id
+        LIMIT :limit
+        """
+    )
+
+
+# one statement per combination of filters, 8 in all, keyed by the filters in use
+MEDIA_PAGES = {
+    filters: media_page(filters)
+    for filters in (
+        tuple(name for i, name in enumerate(MEDIA_PAGE_FILTERS) if combination >> i & 1)
+        for combination in range(2 ** len(MEDIA_PAGE_FILTERS))
+    )
+}
+
+
+# catalog inserts take arrays, one element per title, so posting one title and a bulk
+# catalog drop share the statement. a title that's already in media, or listed earlier in
+# the same batch, is skipped by ON CONFLICT - unique on title, so safe under concurrent
+# writes - and left out of the returned rows. films and shows go in together, films
+# first, so the catalog version is bumped once, after every title is in
+INSERT_TITLES = sqlalchemy.text(
+    """
+    WITH new_films AS (
+        SELECT DISTINCT ON (title) title, director, length, position
+        FROM unnest(CAST(:film_titles AS TEXT[]), CAST(:film_directors AS TEXT[]), CAST(:lengths AS INTEGER[]))
+            WITH ORDINALITY AS new(title, director, length, position)
+        ORDER BY title, position
+    ),
+    new_shows AS (
+        SELECT DISTINCT ON (title) title, director, seasons, episodes, position
+        FROM unnest(CAST(:show_titles AS TEXT[]), CAST(:show_directors AS TEXT[]),
+                    CAST(:seasons AS INTEGER[]), CAST(:episodes AS INTEGER[]))
+            WITH ORDINALITY AS new(title, director, seasons, episodes, position)
+        ORDER BY title, position
+    ),
+    inserted AS (
+        INSERT INTO media (media_type, title, director)
+        SELECT media_type, title, director
+        FROM (
+            SELECT 'movie' AS media_type, title, director, 0 AS kind, position FROM new_films
+            UNION ALL
+            SELECT 'show', title, director, 1, position FROM new_shows
+        ) AS new
+        ORDER BY kind, position
+        ON CONFLICT (title) DO NOTHING
+        RETURNING media_id, media_type, title
+    ),
+    film_details AS (
+        INSERT INTO movies (media_id, length)
+        SELECT inserted.media_id, new_films.length
+        FROM inserted
+        JOIN new_films ON new_films.title = inserted.title
+        WHERE inserted.media_type = 'movie'
+    ),
+    show_details AS (
+        INSERT INTO tv_shows (media_id, total_episodes, total_seasons)
+        SELECT inserted.media_id, new_shows.episodes, new_shows.seasons
+        FROM inserted
+        JOIN new_shows ON new_shows.title = inserted.title
+        WHERE inserted.media_type = 'show'
+    ),
+    bumped AS (
+        UPDATE catalog_revision
+        SET version = nextval('catalog_version')
+        WHERE EXISTS (SELECT 1 FROM inserted)
+    )
+    SELECT media_id, title
+    FROM inserted
+    """
+)
+
+
+# every review write locks its title's media row first, so writers to one title's
+# reviews and rating totals take turns - FOR NO KEY UPDATE doesn't block the
+# foreign key checks of rows referencing the title
+REVIEWED_MEDIA = sqlalchemy.text(
+    """
+    SELECT media_id, title
+    FROM media
+    WHERE title ILIKE :media_title
+    LIMIT 1
+    FOR NO KEY UPDATE
+    """
+)
+
+
+# the delta is worked out in the statement - previous reads the review as it was
+# before the upsert (every CTE shares one snapshot), and with the media row locked
+# no other writer can have changed it since
+UPSERT_REVIEW = sqlalchemy.text(
+    """
+    WITH previous AS (
+        SELECT rating
+        FROM reviews
+        WHERE user_id = :user_id AND media_id = :media_id
+    ),
+    upserted AS (
+        INSERT INTO reviews (user_id, media_id, rating, review)
+        VALUES (:user_id, :media_id, :rating, :review)
+        ON CONFLICT (user_id, media_id)
+        DO UPDATE SET
+        rating = EXCLUDED.rating,
+        review = EXCLUDED.review
+        RETURNING rating
+    ),
+    bumped AS (
+        UPDATE catalog_revision
+        SET version = nextval('catalog_version')
+    )
+    INSERT INTO media_rating_stats (media_id, review_count, rating_sum)
+    SELECT :media_id,
+           CASE WHEN EXISTS (SELECT 1 FROM previous) THEN 0 ELSE 1 END,
+           u.rating - COALESCE((SELECT rating FROM previous), 0)
+    FROM upserted u
+    ON CONFLICT (media_id)
+    DO UPDATE SET
+    review_count = media_rating_stats.review_count + EXCLUDED.review_count,
+    rating_sum = media_rating_stats.rating_sum + EXCLUDED.rating_sum,
+    version = nextval('catalog_version')
+    """
+)
+
+
+CREATE_REVIEW_STAGING = sqlalchemy.text(
+    """
+    CREATE TEMP TABLE review_staging (
+        row_number BIGINT GENERATED BY DEFAULT AS IDENTITY, -- NDJSON rows bring their line number
+        username TEXT,
+        title TEXT,
+        rating TEXT,
+        review TEXT,
+        error TEXT,
+        user_id INTEGER,
+        media_id INTEGER
+    ) ON COMMIT DROP
+    """
+)
+
+
+RESOLVE_STAGED_USERS = sqlalchemy.text(
+    """
+    UPDATE review_staging s
+    SET user_id = u.id
+    FROM users u
+    WHERE u.username = s.username
+    """
+)
+
+
+RESOLVE_STAGED_MEDIA = sqlalchemy.text(
+    """
+    UPDATE review_staging s
+    SET media_id = m.media_id
+    FROM media m
+    WHERE m.title = s.title
+    """
+)
+
+
+VALIDATE_STAGED_REVIEWS = sqlalchemy.text(
+    """
+    UPDATE review_staging s
+    SET error = CASE
+        WHEN s.username IS NULL OR s.title IS NULL OR s.rating IS NULL OR s.review IS NULL
+            THEN 'missing field'
+        WHEN s.user_id IS NULL THEN 'user not found'
+        WHEN s.media_id IS NULL THEN 'media not found'
+        WHEN s.rating !~ '^[[:space:]]*[0-9]+([.][0-9]+)?[[:space:]]*$' THEN 'rating must be a number'
+        WHEN CAST(s.rating AS FLOAT) <= 0 OR CAST(s.rating AS FLOAT) >= 6
+            THEN 'rating must be between 1 and 5'
+        WHEN length(s.review) > 255 THEN 'review longer than 255 characters'
+    END
+    WHERE s.error IS NULL
+    """
+)
+
+
+DEDUPE_STAGED_REVIEWS = sqlalchemy.text(
+    """
+    UPDATE review_staging s
+    SET error = 'replaced by a later row for the same user and title'
+    WHERE s.error IS NULL
+    AND EXISTS (
+        SELECT 1
+        FROM review_staging later
+        WHERE later.user_id = s.user_id
+          AND later.media_id = s.media_id
+          AND later.row_number > s.row_number
+          AND later.error IS NULL
+    )
+    """
+)
+
+
+# the batch's titles, locked in media_id order like REVIEWED_MEDIA locks one
+LOCK_STAGED_MEDIA = sqlalchemy.text(
+    """
+    SELECT 1
+    FROM media
+    WHERE media_id IN (SELECT media_id FROM review_staging WHERE error IS NULL)
+    ORDER BY media_id
+    FOR NO KEY UPDATE
+    """
+)
+
+
+MERGE_STAGED_REVIEWS = sqlalchemy.text(
+    """
+    WITH batch AS (
+        SELECT user_id, media_id, CAST(rating AS FLOAT) AS rating, review
+        FROM review_staging
+        WHERE error IS NULL
+    ),
+    previous AS (
+        SELECT r.user_id, r.media_id, r.rating
+        FROM reviews r
+        JOIN batch b ON b.user_id = r.user_id AND b.media_id = r.media_id
+    ),
+    upserted AS (
+        INSERT INTO reviews (user_id, media_id, rating, review)
+        SELECT user_id, media_id, rating, review
+        FROM batch
+        ON CONFLICT (user_id, media_id)
+        DO UPDATE SET
+        rating = EXCLUDED.rating,
+        review = EXCLUDED.review
+        RETURNING user_id, media_id, rating
+    ),
+    bumped AS (
+        UPDATE catalog_revision
+        SET version = nextval('catalog_version')
+        WHERE EXISTS (SELECT 1 FROM upserted)
+    )
+    INSERT INTO media_rating_stats (media_id, review_count, rating_sum)
+    SELECT u.media_id,
+           COUNT(*) FILTER (WHERE p.user_id IS NULL),
+           SUM(u.rating - COALESCE(p.rating, 0))
+    FROM upserted u
+    LEFT JOIN previous p ON p.user_id = u.user_id AND p.media_id = u.media_id
+    GROUP BY u.media_id
+    ON CONFLICT (media_id)
+    DO UPDATE SET
+    review_count = media_rating_stats.review_count + EXCLUDED.review_count,
+    rating_sum = media_rating_stats.rating_sum + EXCLUDED.rating_sum,
+    version = nextval('catalog_version')
+    """
+)
+
+
+STAGED_REVIEW_COUNTS = sqlalchemy.text(
+    """
+    SELECT COUNT(*) AS received,
+           COUNT(*) FILTER (WHERE error IS NULL) AS merged
+    FROM review_staging
+    """
+)
+
+
+REJECTED_STAGED_REVIEWS = sqlalchemy.text(
+    """
+    SELECT row_number, username, title, error
+    FROM review_staging
+    WHERE error IS NOT NULL
+    ORDER BY row_number
+    LIMIT :limit
+    """
+)
+
+
+REVIEWS_VERSION = sqlalchemy.text(
+    """
+    SELECT stats.version
+    FROM media
+    JOIN media_rating_stats AS stats ON media.media_id = stats.media_id
+    WHERE title = :media_title
+    """
+)
+
+
+REVIEWS_PAGE = sqlalchemy.text(
+    """
+    SELECT reviews.user_id, username, rating, review
+    FROM reviews
+    JOIN users on reviews.user_id = users.id
+    JOIN media on reviews.media_id = media.media_id
+    WHERE title = :media_title
+    AND reviews.user_id > :after_user_id
+    ORDER BY reviews.user_id
+    LIMIT :limit
+    """
+)
+
+
+RECOMMENDATIONS = sqlalchemy.text(
+    """
+    SELECT m.media_id, m.title, m.media_type,
+           COUNT(*) AS friend_count,
+           COUNT(*) + COALESCE(AVG(r.rating), 0) / 10 AS score
+    FROM friendships f
+    JOIN watchlists w ON w.user_id = f.friend_id
+    JOIN media m ON m.media_id = w.media_id
+    LEFT JOIN reviews r ON r.user_id = w.user_id AND r.media_id = w.media_id
+    WHERE f.user_id = :user_id
+      AND NOT EXISTS (
+          SELECT 1
+          FROM watchlists mine
+          WHERE mine.user_id = :user_id
+            AND mine.media_id = w.media_id
+      )
+    GROUP BY m.media_id, m.title, m.media_type
+    ORDER BY score DESC, m.title
+    LIMIT :limit
+    """
+)
+
+
+# ---------------- admin ----------------
+
+# every table holding app data, truncated in one statement so foreign key order doesn't matter
+TABLES = [
+    "watchlists",
+    "reviews",
+    "friendships",
+    "media_rating_stats",
+    "movies",
+    "tv_shows",
+    "media",
+    "users",
+]
+
+TRUNCATE_TABLES = sqlalchemy.text(
+    f"""
+    TRUNCATE {", ".join(TABLES)} RESTART IDENTITY CASCADE
+    """
+)
+
+# catalog_revision isn't truncated, emptying the catalog is a new version of it
+RESET = [TRUNCATE_TABLES, BUMP_CATALOG_VERSION]
+
+# recompute derived aggregates from the base tables
+DELETE_RATING_STATS = sqlalchemy.text(
+    """
+    DELETE FROM media_rating_stats
+    """
+)
+
+REBUILD_RATING_STATS = sqlalchemy.text(
+    """
+    INSERT INTO media_rating_stats (media_id, review_count, rating_sum)
+    SELECT media_id, COUNT(*), SUM(rating)
+    FROM reviews
+    GROUP BY media_id
+    """
+)
+
+# refresh planner statistics, which still describe the old data after a truncate
+ANALYZE = sqlalchemy.text(
+    f"""
+    ANALYZE {", ".join(TABLES)}
+    """
+)
+
+REBUILD = [DELETE_RATING_STATS, REBUILD_RATING_STATS, ANALYZE, BUMP_CATALOG_VERSION]
@@ -1,398 +1,495 @@
 from dataclasses import dataclass
 from fastapi import APIRouter, Depends, status, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field, field_validator
 from typing import List
 from typing import Optional
 
 from src.api.media import MediaInfo
 
-import sqlalchemy
-from src.api import auth
+from src.api import auth, statements
+from src.api.pagination import (
+    Page,
+    DEFAULT_LIMIT,
+    check_limit,
+    decode_cursor,
+    split_page,
+    trusted_page,
+)
 from src import database as db
+from src import cache
 
 router = APIRouter(
     prefix="/users",
     tags=["users"],
 )
 
+
 # username - must be alphanumeric, 3-20 characters long, and start with a letter
-class Username(BaseModel): 
-    username: str = Field(..., min_length=3, max_length=20
-    )
+class Username(BaseModel):
+    username: str = Field(..., min_length=3, max_length=20)
 
     @field_validator("username")
     @classmethod
     def validate_username(cls, s: str) -> str:
         if not s.isalnum() or not s[0].isalpha():
-            raise HTTPException(status_code=400, detail="Username must be alphanumeric and start with a letter.")
+            raise HTTPException(
+                status_code=400,
+                detail="Username must be alphanumeric and start with a letter.",
+            )
             # raise ValueError("Username must be alphanumeric and start with a letter.")
         return s
-    
+
+
 class UserInfo(BaseModel):
     username: Username
     date_joined: str
     size_of_watchlist: int
 
+
+class SuggestedFriend(BaseModel):
+    username: str
+    mutual_friends: int
+
+
 class WatchlistItem(BaseModel):
-    media_id : int
-    title : str
-    director : str
-    have_watched : bool
+    media_id: int
+    title: str
+    director: str
+    have_watched: bool
+
+
+class WatchlistSummary(BaseModel):
+    total: int
+    watched: int
+    unwatched: int
+
+
+class WatchlistImportItem(BaseModel):
+    title: str
+    have_watched: bool = False
 
 
+class WatchlistImportResult(BaseModel):
+    title: str
+    status: str  # added, already_in_watchlist or not_found
+
+
+MAX_BULK_WATCHLIST_ITEMS = 1000
+
 
 # create user
 @router.post("/{username}", status_code=status.HTTP_204_NO_CONTENT)
-def create_new_user(username: str):
+async def create_new_user(username: str):
     validated_username = Username.validate_username(username)
 
     # Check if username is correct length
     if len(validated_username) < 3 or len(validated_username) > 20:
-        raise HTTPException(status_code=400, detail="Username must be between 3 and 20 characters long.")
-
-    with db.engine.begin() as connection:
-
-        user_existing = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT username
-                FROM users
-                WHERE username = :username
-                """
-            ), [{"username": username}]
+        raise HTTPException(
+            status_code=400, detail="Username must be between 3 and 20 characters long."
+        )
+
+    async with db.begin() as connection:
+        user_existing = (
+            await connection.execute(
+                statements.USERNAME_EXISTS, [{"username": username}]
+            )
         ).fetchone()
         if user_existing is None:
-            connection.execute(
-                sqlalchemy.text(
-                """
-                INSERT INTO users (username)
-                VALUES (:username)
-                """
-                ), [{"username": username}]
-            )
+            await connection.execute(statements.INSERT_USER, [{"username": username}])
         else:
-            raise HTTPException(status_code=409, detail="Username already exists. Please try again.")
+            raise HTTPException(
+                status_code=409, detail="Username already exists. Please try again."
+            )
 
 
 # Post to watchlist
 @router.post("/{username}/watchlist", status_code=status.HTTP_204_NO_CONTENT)
-def add_to_watchlist(username: str, title: str, have_watched: bool=False):
-    
-    with db.engine.begin() as connection:
+async def add_to_watchlist(username: str, title: str, have_watched: bool = False):
+    async with db.begin() as connection:
         # fetch user_id
-        user_id = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT id FROM users
-                WHERE username = :username"""
-            ), [{"username": username}]
+        user_id = (
+            await connection.execute(statements.USER_ID, [{"username": username}])
         ).scalar()
 
         if not user_id:
-            raise HTTPException(status_code=404, detail="User not found. Please try again.")
+            raise HTTPException(
+                status_code=404, detail="User not found. Please try again."
+            )
 
         # fetch media_id
-        media_id = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT media_id FROM media
-                WHERE title = :title
-                """
-            ), [{"title": title}]
+        media_id = (
+            await connection.execute(statements.MEDIA_ID_BY_TITLE, [{"title": title}])
         ).scalar()
-        
+
         if not media_id:
-            raise HTTPException(status_code=404, detail="Media not found. Please try again.")
+            raise HTTPException(
+                status_code=404, detail="Media not found. Please try again."
+            )
 
         # check if entry already exists
-        existing_entry = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT * FROM watchlists
-                WHERE user_id = :user_id AND media_id = :media_id
-                """
-            ), [{"user_id": user_id, "media_id": media_id}]
+        existing_entry = (
+            await connection.execute(
+                statements.WATCHLIST_ENTRY, [{"user_id": user_id, "media_id": media_id}]
+            )
         ).fetchone()
 
         if existing_entry:
-            raise HTTPException(status_code = 409, detail = "Media already in watchlist")
-        
+            raise HTTPException(status_code=409, detail="Media already in watchlist")
+
         # add to watchlist
-        connection.execute(
-            sqlalchemy.text(
-                """
-                INSERT INTO watchlists (user_id, media_id, have_watched)
-                VALUES (:user_id, :media_id, :have_watched)
-                """
-            ), [{"user_id": user_id, "media_id": media_id, "have_watched": have_watched}]
+        await connection.execute(
+            statements.INSERT_WATCHLIST_ENTRY,
+            [{"user_id": user_id, "media_id": media_id, "have_watched": have_watched}],
         )
-      
+        # the watchlist and its size on the profile changed
+        await cache.invalidate(connection, f"watchlist:{username}", f"user:{username}")
 
 
+# Post many titles to watchlist
+@router.post("/{username}/watchlist/bulk", response_model=List[WatchlistImportResult])
+async def add_to_watchlist_bulk(username: str, items: List[WatchlistImportItem]):
+    if len(items) > MAX_BULK_WATCHLIST_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot import more than {MAX_BULK_WATCHLIST_ITEMS} titles at once.",
+        )
+
+    async with db.begin() as connection:
+        # fetch user_id
+        user_id = (
+            await connection.execute(statements.USER_ID, [{"username": username}])
+        ).scalar()
+
+        if not user_id:
+            raise HTTPException(
+                status_code=404, detail="User not found. Please try again."
+            )
+
+        # resolve every title at once
+        media_ids = {
+            row.title: row.media_id
+            for row in (
+                await connection.execute(
+                    statements.MEDIA_IDS_BY_TITLES,
+                    [{"titles": list({item.title for item in items})}],
+                )
+            ).fetchall()
+        }
+
+        found = [item for item in items if item.title in media_ids]
+        added = set()
+        if found:
+            # add to watchlist, skipping titles that are already on it
+            added = {
+                row.media_id
+                for row in (
+                    await connection.execute(
+                        statements.INSERT_WATCHLIST_ENTRIES,
+                        [
+                            {
+                                "user_id": user_id,
+                                "media_ids": [media_ids[item.title] for item in found],
+                                "have_watched": [item.have_watched for item in found],
+                            }
+                        ],
+                    )
+                ).fetchall()
+            }
+            if added:
+                await cache.invalidate(
+                    connection, f"watchlist:{username}", f"user:{username}"
+                )
+
+    results = []
+    for item in items:
+        if item.title not in media_ids:
+            item_status = "not_found"
+        elif media_ids[item.title] in added:
+            item_status = "added"
+            # a title listed twice is only added once
+            added.remove(media_ids[item.title])
+        else:
+            item_status = "already_in_watchlist"
+        results.append(WatchlistImportResult(title=item.title, status=item_status))
+
+    return results
+
 
 # Mark as watched
-@router.patch("/{username}/watchlist/{media_title}", status_code=status.HTTP_204_NO_CONTENT)
-def mark_as_watched(username: str, media_title: str):
-    with db.engine.begin() as connection:
+@router.patch(
+    "/{username}/watchlist/{media_title}", status_code=status.HTTP_204_NO_CONTENT
+)
+async def mark_as_watched(username: str, media_title: str):
+    async with db.begin() as connection:
         # check that entry exists
-        row = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT * FROM watchlists
-                WHERE user_id = (SELECT id FROM users WHERE username = :username)
-                AND media_id = (SELECT media_id FROM media WHERE title = :title)
-                """
-            ), [{"username": username, "title": media_title}]
+        row = (
+            await connection.execute(
+                statements.WATCHLIST_ENTRY_BY_NAMES,
+                [{"username": username, "title": media_title}],
+            )
         ).fetchone()
 
         if not row:
-            raise HTTPException(status_code=404, detail="Entry not found. Please try again.")
+            raise HTTPException(
+                status_code=404, detail="Entry not found. Please try again."
+            )
 
         # update entry
-        connection.execute(
-            sqlalchemy.text(
-                """
-                UPDATE watchlists
-                SET have_watched = TRUE
-                WHERE user_id = (SELECT id FROM users WHERE username = :username)
-                AND media_id = (SELECT media_id FROM media WHERE title = :title)
-                """
-            ), [{"username": username, "title": media_title}]
+        await connection.execute(
+            statements.MARK_AS_WATCHED, [{"username": username, "title": media_title}]
         )
+        await cache.invalidate(connection, f"watchlist:{username}")
 
 
 # Get Watchlist
-@router.get("/{username}/watchlist", response_model=List[WatchlistItem])  
-def get_watchlist(username: str, only_watched_media: bool=False):
-    with db.engine.begin() as connection:
-        result = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT * FROM watchlists
-                JOIN users ON watchlists.user_id = users.id
-                JOIN media ON watchlists.media_id = media.media_id
-                WHERE users.username = :username
-                """
-            ), [{"username": username}]
+@router.get("/{username}/watchlist", response_model=Page[WatchlistItem])
+@cache.cached("watchlist:{username}", Page[WatchlistItem])
+async def get_watchlist(
+    username: str,
+    only_watched_media: bool = False,
+    limit: int = DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+):
+    check_limit(limit)
+    after = decode_cursor(cursor, [int]) or [0]
+
+    async with db.begin() as connection:
+        result = (
+            await connection.execute(
+                statements.WATCHED_WATCHLIST_PAGE
+                if only_watched_media
+                else statements.WATCHLIST_PAGE,
+                [
+                    {
+                        "username": username,
+                        "after_media_id": after[0],
+                        "limit": limit + 1,
+                    }
+                ],
+            )
         ).fetchall()
-        print(f'result: {result}')
-    
-    watchlist = [WatchlistItem(media_id=entry.media_id, title=entry.title, director=entry.director, have_watched=entry.have_watched) for entry in result]
-    if only_watched_media:
-        watchlist = [entry for entry in watchlist if entry.have_watched]
 
-    return watchlist
-    
+    result, next_cursor = split_page(result, limit, lambda entry: [entry.media_id])
+    watchlist = [
+        WatchlistItem(
+            media_id=entry.media_id,
+            title=entry.title,
+            director=entry.director,
+            have_watched=entry.have_watched,
+        )
+        for entry in result
+    ]
+
+    return Page[WatchlistItem](items=watchlist, next_cursor=next_cursor)
 
 
+# Watchlist counts, without sending the titles
+@router.get("/{username}/watchlist/summary", response_model=WatchlistSummary)
+@cache.cached("watchlist:{username}", WatchlistSummary)
+async def get_watchlist_summary(username: str):
+    async with db.begin() as connection:
+        result = (
+            await connection.execute(
+                statements.WATCHLIST_SUMMARY, [{"username": username}]
+            )
+        ).fetchone()
 
-# Search for user, maybe return all users on empty search?
-@router.get("/search", response_model=List[Username])
-def search_users(username: Optional[str] = None):
+    if not result:
+        raise HTTPException(status_code=404, detail="User not found. Please try again.")
 
-    with db.engine.begin() as connection:
+    return WatchlistSummary(
+        total=result.total,
+        watched=result.watched,
+        unwatched=result.total - result.watched,
+    )
 
+
+# Search for user, returns all users a page at a time on empty search
+@router.get("/search", response_model=Page[Username], response_class=ORJSONResponse)
+async def search_users(
+    username: Optional[str] = None,
+    limit: int = DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+):
+    check_limit(limit)
+    after = decode_cursor(cursor, [str]) or [""]
+
+    async with db.begin() as connection:
         if not username:
-            # If no username is provided, return all usernames
-            result = connection.execute(
-                sqlalchemy.text(
-                    """
-                    SELECT username
-                    FROM users
-                    """
+            # If no username is provided, page through all usernames
+            result = (
+                await connection.execute(
+                    statements.USERNAMES_PAGE,
+                    [{"after_username": after[0], "limit": limit + 1}],
                 )
             ).fetchall()
 
         else:
             # If username is provided, search for usernames that start with the given string
-            result = connection.execute(
-                sqlalchemy.text(
-                """
-                SELECT username
-                FROM users
-                WHERE LOWER(username) LIKE LOWER(:username)
-                """
-                ), [{"username": f"{username}%"}]
-                ).fetchall()
-
+            result = (
+                await connection.execute(
+                    statements.USERNAME_SEARCH_PAGE,
+                    [
+                        {
+                            "username": f"{username}%",
+                            "after_username": after[0],
+                            "limit": limit + 1,
+                        }
+                    ],
+                )
+            ).fetchall()
 
-        if not result:
-            raise HTTPException(status_code=404, detail="No users found. Please try again.")
+        if not result and cursor is None:
+            raise HTTPException(
+                status_code=404, detail="No users found. Please try again."
+            )
 
-        return [Username(username=row.username) for row in result]
+        result, next_cursor = split_page(result, limit, lambda row: [row.username])
+        # usernames were validated on the way in, pages can hold hundreds so skip building a model per row
+        return trusted_page([{"username": row.username} for row in result], next_cursor)
 
 
 # view user
 @router.get("/{username}", response_model=UserInfo)
-def view_user(username: str):
-    with db.engine.begin() as connection:
-        result = connection.execute(
-            sqlalchemy.text(
-            
-                """
-                SELECT *
-                FROM users AS u
-                WHERE u.username = :username
-                """
-            ), [{"username": username}]
+@cache.cached("user:{username}", UserInfo)
+async def view_user(username: str):
+    async with db.begin() as connection:
+        result = (
+            await connection.execute(statements.USER_PROFILE, [{"username": username}])
         ).fetchone()
 
-
         if not result:
-            raise HTTPException(status_code=404, detail="User not found. Please try again.")
-        
-        
-        watchlist_count = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT COUNT(*)
-                FROM watchlists AS w
-                WHERE w.user_id = (SELECT id FROM users WHERE username = :username)
-                """
-            ), [{"username": username}]        
-            ).scalar_one()
-        
-        return UserInfo(username=Username(username=username), date_joined=str(result.date_joined), size_of_watchlist=watchlist_count)
-
-        
+            raise HTTPException(
+                status_code=404, detail="User not found. Please try again."
+            )
+
+        return UserInfo(
+            username=Username(username=username),
+            date_joined=str(result.date_joined),
+            size_of_watchlist=result.size_of_watchlist,
+        )
+
 
 # friend user
 @router.post("/{username}/friends", status_code=status.HTTP_204_NO_CONTENT)
-def add_friend(username: str, friend_username: Username):
-    with db.engine.begin() as connection:
-        result = connection.execute(
-            sqlalchemy.text(
-            
-                """
-                SELECT id 
-                FROM users
-                WHERE username = :username
-                """
-            ), [{"username": username}]
-        ).fetchone()
+async def add_friend(username: str, friend_username: Username):
+    async with db.begin() as connection:
+        users = (
+            await connection.execute(
+                statements.USER_IDS_BY_USERNAMES,
+                [{"username": username, "friend_username": friend_username.username}],
+            )
+        ).fetchall()
+        ids = {row.username: row.id for row in users}
 
-        if not result:
-            raise HTTPException(status_code=404, detail="User not found. Please try again.")
-        
-        user_id = result.id
-
-        result2 = connection.execute(
-            sqlalchemy.text(
-            
-                """
-                SELECT id 
-                FROM users
-                WHERE username = :username
-                """
-            ), [{"username": friend_username.username}]
+        if username not in ids or friend_username.username not in ids:
+            raise HTTPException(
+                status_code=404, detail="User not found. Please try again."
+            )
+
+        if username == friend_username.username:
+            raise HTTPException(
+                status_code=400, detail="Cannot add yourself as a friend."
+            )
+
+        # add to friend list
+        added = (
+            await connection.execute(
+                statements.INSERT_FRIENDSHIP,
+                [
+                    {
+                        "user_id": ids[username],
+                        "friend_id": ids[friend_username.username],
+                    }
+                ],
+            )
         ).fetchone()
 
-        if not result2:
-            raise HTTPException(status_code=404, detail="User not found. Please try again.")
-        
-        friend_id = result2.id
+        if not added:
+            raise HTTPException(
+                status_code=409, detail="Already friends with this user."
+            )
 
-        # check if entry already exists
-        existing_entry = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT friends
-                FROM users
-                WHERE id = :user_id
-                """
-            ), [{"user_id": user_id}]
-        ).one()
-
-        friend_list = existing_entry.friends or []
-        if friend_id in friend_list:
-            raise HTTPException(status_code=409, detail="Already friends with this user.")
-        else:
-            friend_list.append(friend_id)
-            # add to friend list
-            connection.execute(
-                sqlalchemy.text(
-                    """
-                    UPDATE users
-                    SET friends = :friend_list
-                    WHERE id = :user_id
-                    """
-                ), [{"friend_list": friend_list, "user_id": user_id}]
+
+# unfriend user
+@router.delete(
+    "/{username}/friends/{friend_username}", status_code=status.HTTP_204_NO_CONTENT
+)
+async def remove_friend(username: str, friend_username: str):
+    async with db.begin() as connection:
+        removed = (
+            await connection.execute(
+                statements.DELETE_FRIENDSHIP,
+                [{"username": username, "friend_username": friend_username}],
             )
+        ).fetchone()
 
-# Get suggested friends
-@router.get("/{username}/suggested_friends", response_model=List[Username])
-def get_suggested_friends(username: str):
-    with db.engine.begin() as connection:
-        # fetch user_id
-        user_id = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT id FROM users
-                WHERE username = :username
-                """
-            ), [{"username": username}]
+        if not removed:
+            raise HTTPException(
+                status_code=404, detail="Friend not found. Please try again."
+            )
+
+
+# Get followers - users who have this user as a friend
+@router.get("/{username}/followers", response_model=List[Username])
+async def get_followers(username: str):
+    async with db.begin() as connection:
+        user_id = (
+            await connection.execute(statements.USER_ID, [{"username": username}])
         ).scalar()
 
         if not user_id:
-            raise HTTPException(status_code=404, detail="User not found. Please try again.")
-
-        # fetch friends
-        result = connection.execute(
-            sqlalchemy.text(
-                """
-                SELECT friends
-                FROM users
-                WHERE id = :user_id
-                """
-            ), [{"user_id": user_id}]
+            raise HTTPException(
+                status_code=404, detail="User not found. Please try again."
+            )
+
+        followers = (
+            await connection.execute(statements.FOLLOWERS, [{"user_id": user_id}])
+        ).fetchall()
+
+        return [Username(username=row.username) for row in followers]
+
+
+# Get suggested friends
+@router.get("/{username}/suggested_friends", response_model=List[SuggestedFriend])
+async def get_suggested_friends(username: str, min_mutual: int = 3, limit: int = 20):
+    if min_mutual < 1:
+        raise HTTPException(status_code=400, detail="min_mutual must be at least 1.")
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code=400, detail="Limit must be between 1 and 100.")
+
+    async with db.begin() as connection:
+        # fetch user_id and whether they have any friends
+        result = (
+            await connection.execute(
+                statements.USER_ID_AND_HAS_FRIENDS, [{"username": username}]
+            )
         ).fetchone()
 
-        if not result or not result.friends:
-            raise HTTPException(status_code=404, detail="No friends found. Please try again.")
-        
-        friends = result.friends
-
-        # create dictionary of friends of friends
-        friend_of_friends = {}
-        for friend in friends:
-            friend_friends = connection.execute(
-                sqlalchemy.text(
-                    """
-                    SELECT friends
-                    FROM users
-                    WHERE id = :friend_id
-                    """
-                ), [{"friend_id": friend}]
-            ).fetchone()
-            
-            if friend_friends:
-                for ff in friend_friends.friends:
-                    if ff not in friends and ff != user_id:
-                        if ff not in friend_of_friends:
-                            friend_of_friends[ff] = 1
-                        else:
-                            friend_of_friends[ff] += 1
-        # sort by number of mutual friends
-        suggested_friends = sorted([(user_id, count) for user_id, count in friend_of_friends.items() if count >= 3], key=lambda x: x[1], reverse=True)
-        # return usernames of suggested friends
-
-
-        suggested_usernames = []
-        for friend in suggested_friends:
-            friend_usernames = connection.execute(
-                sqlalchemy.text(
-                    """
-                    SELECT username
-                    FROM users
-                    WHERE id = :friend_id
-                    """
-                ), [{"friend_id": friend[0]}]
-            ).scalar_one()
-
-            suggested_usernames.append(Username(username=friend_usernames))
-
-
-
-        if not suggested_usernames:
-            raise HTTPException(status_code=404, detail="No suggested friends found. Please try again.")
-        return suggested_usernames
+        if not result:
+            raise HTTPException(
+                status_code=404, detail="User not found. Please try again."
+            )
+
+        if not result.has_friends:
+            raise HTTPException(
+                status_code=404, detail="No friends found. Please try again."
+            )
+
+        # count mutual friends for every friend of a friend and join their usernames
+        suggested_friends = (
+            await connection.execute(
+                statements.SUGGESTED_FRIENDS,
+                [{"user_id": result.id, "min_mutual": min_mutual, "limit": limit}],
+            )
+        ).fetchall()
+
+        if not suggested_friends:
+            raise HTTPException(
+                status_code=404, detail="No suggested friends found. Please try again."
+            )
+        return [
+            SuggestedFriend(username=row.username, mutual_friends=row.mutual_friends)
+            for row in suggested_friends
+        ]
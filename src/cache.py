@@ -0,0 +1,480 @@
+import functools
+import inspect
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import psycopg
+import sqlalchemy
+from pydantic import TypeAdapter, ValidationError
+from starlette.concurrency import run_in_threadpool
+from src import config
+
+try:
+    import redis  # type: ignore[import-not-found]
+except ImportError:  # only needed for CACHE_BACKEND=redis
+    redis = None
+
+settings = config.get_settings()
+logger = logging.getLogger(__name__)
+
+# postgres channel that write endpoints notify with the tags they invalidated
+CHANNEL = "cache_invalidation"
+# payload telling every worker to drop its whole cache
+CLEAR_ALL = "*"
+
+
+class CacheBackend:
+    """
+    Base for cache backends. Keys are strings and every key belongs to a tag, so
+    writes can invalidate all keys under a tag at once, e.g. every cached page of
+    one user's watchlist. Counters are per worker process.
+
+    Shared backends are read and written by every worker, so they only hold JSON
+    bytes - a pickle from the store would run whatever code whoever wrote it chose.
+    """
+
+    name = ""
+    blocking = False  # True if calls do I/O and should run in the threadpool
+    shared = False  # True if other worker processes read and write the same entries
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str):
+        """
+        Return (True, value) on a hit and (False, None) on a miss
+        """
+        raise NotImplementedError
+
+    def set(self, tag: str, key: str, value):
+        raise NotImplementedError
+
+    def invalidate(self, *tags: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def size(self) -> Optional[int]:
+        """
+        Number of cached entries, None if the backend can't count them cheaply
+        """
+        raise NotImplementedError
+
+
+class TTLCache(CacheBackend):
+    """
+    In-process LRU cache with a time-to-live
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries: int, ttl: float):
+        super().__init__(max_entries, ttl)
+        self.entries: OrderedDict = (
+            OrderedDict()
+        )  # key -> (tag, expires_at, value), least recently used first
+        self.tags: dict[str, set] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            if entry[1] < time.monotonic():
+                self.remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+
+    def set(self, tag, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (tag, time.monotonic() + self.ttl, value)
+            self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        with self.lock:
+            for tag in tags:
+                for key in self.tags.pop(tag, ()):
+                    self.entries.pop(key, None)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.tags.clear()
+
+    def size(self):
+        return len(self.entries)
+
+    def remove(self, key):
+        # caller holds the lock
+        tag, _, _ = self.entries.pop(key)
+        keys = self.tags[tag]
+        keys.discard(key)
+        if not keys:
+            del self.tags[tag]
+
+
+class SQLiteCache(CacheBackend):
+    """
+    LRU cache with a time-to-live in a SQLite file, shared by every worker on one host
+    """
+
+    name = "sqlite"
+    blocking = True
+    shared = True
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        super().__init__(max_entries, ttl)
+        self.lock = threading.Lock()
+        # autocommit, each statement is its own transaction
+        self.connection = sqlite3.connect(
+            path, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        with self.lock:
+            # readers don't block the writer
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    tag TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    value BLOB NOT NULL
+                )
+                """
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_entries_tag ON cache_entries (tag)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_entries_accessed_at ON cache_entries (accessed_at)"
+            )
+
+    def get(self, key):
+        # wall clock time, monotonic clocks aren't comparable across processes
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT expires_at, value FROM cache_entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            if row[0] < now:
+                self.connection.execute(
+                    "DELETE FROM cache_entries WHERE key = ?", (key,)
+                )
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self.connection.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+        return True, row[1]
+
+    def set(self, tag, key, value: bytes):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                """
+                INSERT OR REPLACE INTO cache_entries (key, tag, expires_at, accessed_at, value)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (key, tag, now + self.ttl, now, value),
+            )
+            # drop the least recently used entries beyond max_entries
+            self.evictions += self.connection.execute(
+                """
+                DELETE FROM cache_entries
+                WHERE key IN (
+                    SELECT key FROM cache_entries
+                    ORDER BY accessed_at
+                    LIMIT MAX((SELECT COUNT(*) FROM cache_entries) - ?, 0)
+                )
+                """,
+                (self.max_entries,),
+            ).rowcount
+
+    def invalidate(self, *tags):
+        with self.lock:
+            self.invalidations += self.connection.execute(
+                f"DELETE FROM cache_entries WHERE tag IN ({', '.join('?' * len(tags))})",
+                tags,
+            ).rowcount
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += self.connection.execute(
+                "DELETE FROM cache_entries"
+            ).rowcount
+
+    def size(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM cache_entries"
+            ).fetchone()[0]
+
+
+class RedisCache(CacheBackend):
+    """
+    Cache in any server speaking the Redis protocol, shared by every worker on every host.
+    Entries expire with the ttl, LRU eviction is left to the server's maxmemory-policy.
+    """
+
+    name = "redis"
+    blocking = True
+    shared = True
+    prefix = "nextflix:cache:"
+
+    def __init__(self, url: str, max_entries: int, ttl: float):
+        if redis is None:
+            raise ValueError("CACHE_BACKEND=redis needs the redis package installed.")
+        super().__init__(max_entries, ttl)
+        self.client = redis.Redis.from_url(url)
+
+    def tag_key(self, tag: str) -> str:
+        # set of the keys under a tag
+        return f"{self.prefix}tag:{tag}"
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, value
+
+    def set(self, tag, key, value: bytes):
+        ttl = max(int(self.ttl), 1)
+        pipeline = self.client.pipeline()
+        pipeline.set(self.prefix + key, value, ex=ttl)
+        pipeline.sadd(self.tag_key(tag), self.prefix + key)
+        pipeline.expire(self.tag_key(tag), ttl)
+        pipeline.execute()
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            keys = self.client.smembers(self.tag_key(tag))
+            if keys:
+                self.invalidations += self.client.delete(*keys)
+            self.client.delete(self.tag_key(tag))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self.invalidations += self.client.delete(*keys)
+
+    def size(self):
+        return None
+
+
+def create_backend() -> CacheBackend:
+    if settings.CACHE_BACKEND == "sqlite":
+        path = settings.CACHE_SQLITE_PATH or os.path.join(
+            tempfile.gettempdir(), "nextflix-cache.sqlite3"
+        )
+        return SQLiteCache(path, settings.CACHE_MAX_ENTRIES, settings.CACHE_TTL)
+    if settings.CACHE_BACKEND == "redis":
+        return RedisCache(
+            settings.CACHE_REDIS_URL, settings.CACHE_MAX_ENTRIES, settings.CACHE_TTL
+        )
+    return TTLCache(settings.CACHE_MAX_ENTRIES, settings.CACHE_TTL)
+
+
+cache = create_backend()
+
+
+async def call(method, *args):
+    # backends doing I/O run in the threadpool instead of blocking the event loop
+    if cache.blocking:
+        return await run_in_threadpool(method, *args)
+    return method(*args)
+
+
+def make_key(name: str, arguments: dict) -> str:
+    return f"{name}:{sorted(arguments.items())!r}"
+
+
+async def get(key: str, adapter: TypeAdapter):
+    """
+    Return (True, value) on a hit and (False, None) on a miss or with the cache turned off.
+    Shared backends hold JSON, adapter validates it back into the type that was put.
+    """
+    if not settings.CACHE_ENABLED:
+        return False, None
+    hit, value = await call(cache.get, key)
+    if hit and cache.shared:
+        try:
+            value = adapter.validate_json(value)
+        except ValidationError:
+            # written by a worker running a different version of the model
+            return False, None
+    return hit, value
+
+
+async def put(tag: str, key: str, value, adapter: TypeAdapter):
+    if settings.CACHE_ENABLED:
+        if cache.shared:
+            value = adapter.dump_json(value)
+        await call(cache.set, tag, key, value)
+
+
+def cached(tag: str, value_type: Any):
+    """
+    Cache an async handler's return value. tag is formatted with the handler's
+    arguments, e.g. "watchlist:{username}", and names what a write has to
+    invalidate. The full key also includes every other argument. value_type is
+    what the handler returns, usually its response_model.
+    """
+    adapter = TypeAdapter(value_type)
+
+    def decorator(handler):
+        signature = inspect.signature(handler)
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            key = make_key(handler.__qualname__, arguments.arguments)
+
+            hit, value = await get(key, adapter)
+            if hit:
+                return value
+
+            value = await handler(*args, **kwargs)
+            await put(tag.format(**arguments.arguments), key, value, adapter)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+NOTIFY_STATEMENT = sqlalchemy.text(
+    """
+    SELECT pg_notify(:channel, tag)
+    FROM unnest(CAST(:tags AS TEXT[])) AS tag
+    """
+)
+
+
+async def invalidate(connection, *tags: str):
+    """
+    Drop every cached value under the given tags, call inside the write's transaction.
+    Other workers are told through a notification, which postgres only delivers once
+    the transaction commits - it also reaches this worker, clearing anything a
+    concurrent read cached from before the commit.
+    """
+    await call(cache.invalidate, *tags)
+    if settings.CACHE_NOTIFY:
+        await connection.execute(
+            NOTIFY_STATEMENT, [{"channel": CHANNEL, "tags": list(tags)}]
+        )
+
+
+async def clear(connection):
+    """
+    Drop every cached value, for writes that touch too much to invalidate by tag
+    """
+    await call(cache.clear)
+    if settings.CACHE_NOTIFY:
+        await connection.execute(
+            NOTIFY_STATEMENT, [{"channel": CHANNEL, "tags": [CLEAR_ALL]}]
+        )
+
+
+def clear_blocking(connection):
+    """
+    clear() for scripts on a sync connection, e.g. populate.py - running workers are
+    told through the same notification, and shared backends are emptied directly
+    """
+    cache.clear()
+    if settings.CACHE_NOTIFY:
+        connection.execute(
+            NOTIFY_STATEMENT, [{"channel": CHANNEL, "tags": [CLEAR_ALL]}]
+        )
+
+
+class InvalidationListener:
+    """
+    Background thread applying every worker's invalidations to this worker's cache,
+    reconnecting if the connection drops
+    """
+
+    def __init__(self, conninfo: str):
+        self.conninfo = conninfo
+        self.stopping = threading.Event()
+        self.listening = threading.Event()  # set while connected
+        self.thread = threading.Thread(
+            target=self.run, name="cache-invalidation-listener", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                with psycopg.connect(self.conninfo, autocommit=True) as connection:
+                    connection.execute(f"LISTEN {CHANNEL}")
+                    # anything could have changed while we weren't listening. A shared cache
+                    # already had every write's invalidation applied by the worker that made
+                    # it, and clearing it here would empty it for all workers on each restart
+                    if not cache.shared:
+                        cache.clear()
+                    self.listening.set()
+                    while not self.stopping.is_set():
+                        # wake up every second to check for stop()
+                        for notification in connection.notifies(timeout=1):
+                            if notification.payload == CLEAR_ALL:
+                                cache.clear()
+                            else:
+                                cache.invalidate(notification.payload)
+            except Exception:
+                self.listening.clear()
+                logger.exception("Cache invalidation listener disconnected, retrying")
+                self.stopping.wait(5)
+
+
+def start_listener(url: sqlalchemy.URL) -> Optional[InvalidationListener]:
+    """
+    Start applying invalidations from other workers, if the cache is on and notifications are enabled
+    """
+    if not (settings.CACHE_ENABLED and settings.CACHE_NOTIFY):
+        return None
+    listener = InvalidationListener(
+        url.set(drivername="postgresql").render_as_string(hide_password=False)
+    )
+    listener.start()
+    return listener
@@ -12,12 +12,92 @@ load_dotenv(dotenv_path=find_dotenv(".env"), override=True)
 class Settings:
     API_KEY: str | None = os.getenv("API_KEY")
     POSTGRES_URI: str | None = os.getenv("POSTGRES_URI")
+    # route handlers use the async engine, set DB_ASYNC=false to fall back to the sync engine
+    DB_ASYNC: bool = os.getenv("DB_ASYNC", "true").lower() not in ("false", "0", "no")
+
+    # connection pool - per engine, and per worker process
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    # pessimistic pings every connection on checkout (one extra round trip),
+    # optimistic skips the ping and drops connections when a query hits a disconnect
+    DB_DISCONNECT_MODE: str = os.getenv("DB_DISCONNECT_MODE", "pessimistic")
+    # psycopg prepares a statement server-side once a connection has run it this many times,
+    # 0 prepares on first use and "none" turns prepared statements off (e.g. behind pgbouncer)
+    DB_PREPARE_THRESHOLD: int | None = (
+        None
+        if os.getenv("DB_PREPARE_THRESHOLD", "1").lower() == "none"
+        else int(os.getenv("DB_PREPARE_THRESHOLD", "1"))
+    )
+
+    # cache for hot read endpoints
+    CACHE_ENABLED: bool = os.getenv("CACHE_ENABLED", "true").lower() not in (
+        "false",
+        "0",
+        "no",
+    )
+    CACHE_TTL: float = float(os.getenv("CACHE_TTL", "30"))  # seconds
+    CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+    # memory is per worker, sqlite is a file shared by the workers on one host,
+    # redis is shared by every host (needs the redis package)
+    CACHE_BACKEND: str = os.getenv("CACHE_BACKEND", "memory")
+    CACHE_SQLITE_PATH: str | None = os.getenv(
+        "CACHE_SQLITE_PATH"
+    )  # defaults to a file in the temp directory
+    CACHE_REDIS_URL: str = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    # writes notify every worker of what they invalidated through postgres LISTEN/NOTIFY
+    CACHE_NOTIFY: bool = os.getenv("CACHE_NOTIFY", "true").lower() not in (
+        "false",
+        "0",
+        "no",
+    )
+
+    # per-request query checks for development and tests - off, warn or raise. a request running
+    # more than QUERY_BUDGET statements or one statement more than QUERY_REPEAT_LIMIT times is flagged
+    QUERY_CHECK: str = os.getenv("QUERY_CHECK", "off")
+    QUERY_BUDGET: int = int(os.getenv("QUERY_BUDGET", "10"))
+    QUERY_REPEAT_LIMIT: int = int(os.getenv("QUERY_REPEAT_LIMIT", "3"))
+
+    # statements slower than SLOW_QUERY_MS are kept for GET /admin/slow_queries, with their
+    # plans when SLOW_QUERY_EXPLAIN is on. values of the SLOW_QUERY_REDACT parameters are hidden
+    SLOW_QUERY_ENABLED: bool = os.getenv("SLOW_QUERY_ENABLED", "true").lower() not in (
+        "false",
+        "0",
+        "no",
+    )
+    SLOW_QUERY_MS: float = float(os.getenv("SLOW_QUERY_MS", "200"))
+    SLOW_QUERY_LOG_SIZE: int = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+    SLOW_QUERY_EXPLAIN: bool = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() in (
+        "true",
+        "1",
+        "yes",
+    )
+    SLOW_QUERY_REDACT: str = os.getenv(
+        "SLOW_QUERY_REDACT", "review,password,token,secret"
+    )
+
+    # responses at least this many bytes are gzipped for clients that accept it
+    GZIP_MINIMUM_SIZE: int = int(os.getenv("GZIP_MINIMUM_SIZE", "1000"))
+    GZIP_COMPRESS_LEVEL: int = int(
+        os.getenv("GZIP_COMPRESS_LEVEL", "6")
+    )  # 1 fastest - 9 smallest
 
     def __init__(self):
         if not self.API_KEY:
             raise ValueError("API_KEY is missing in the environment variables.")
         if not self.POSTGRES_URI:
             raise ValueError("POSTGRES_URI is missing in the environment variables.")
+        if self.DB_DISCONNECT_MODE not in ("pessimistic", "optimistic"):
+            raise ValueError(
+                "DB_DISCONNECT_MODE must be either 'pessimistic' or 'optimistic'."
+            )
+        if self.CACHE_BACKEND not in ("memory", "sqlite", "redis"):
+            raise ValueError(
+                "CACHE_BACKEND must be one of 'memory', 'sqlite' or 'redis'."
+            )
+        if self.QUERY_CHECK not in ("off", "warn", "raise"):
+            raise ValueError("QUERY_CHECK must be one of 'off', 'warn' or 'raise'.")
 
 
 @lru_cache()
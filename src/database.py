@@ -1,5 +1,127 @@
+import time
+from contextlib import asynccontextmanager
 from src import config
-from sqlalchemy import create_engine
+from src import metrics
+from src import slow_queries
+from sqlalchemy import Connection, CursorResult, Executable, create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.concurrency import run_in_threadpool
 
-connection_url = config.get_settings().POSTGRES_URI
-engine = create_engine(connection_url, pool_pre_ping=True)
+settings = config.get_settings()
+
+connection_url = settings.POSTGRES_URI
+engine_options = {
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+    "pool_recycle": settings.DB_POOL_RECYCLE,
+    "pool_pre_ping": settings.DB_DISCONNECT_MODE == "pessimistic",
+    "connect_args": {"prepare_threshold": settings.DB_PREPARE_THRESHOLD},
+}
+engine = create_engine(connection_url, **engine_options)
+
+# postgresql+psycopg urls get psycopg's async driver on an async engine
+async_engine = create_async_engine(connection_url, **engine_options)
+
+# count queries and database time per request on both engines
+metrics.instrument(engine)
+metrics.instrument(async_engine.sync_engine)
+# keep slow statements from either engine, explained on the sync one
+slow_queries.instrument(engine, explain_engine=engine)
+slow_queries.instrument(async_engine.sync_engine, explain_engine=engine)
+
+
+class PoolStats:
+    """
+    Running totals of how long handlers waited to check out a connection
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float):
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+pool_stats = PoolStats()
+
+
+class ThreadedConnection:
+    """
+    Wraps a sync connection so handlers can await it like an AsyncConnection,
+    each call runs in the threadpool instead of blocking the event loop
+    """
+
+    def __init__(self, connection: Connection):
+        self.connection = connection
+
+    async def execute(
+        self, statement: Executable, parameters=None, **kwargs
+    ) -> CursorResult:
+        return await run_in_threadpool(
+            lambda: self.connection.execute(statement, parameters, **kwargs)
+        )
+
+
+@asynccontextmanager
+async def begin():
+    """
+    Open a connection and transaction for an async handler, committed on exit
+    and rolled back on error. Uses the async engine unless DB_ASYNC is turned off.
+    """
+    start = time.perf_counter()
+
+    if settings.DB_ASYNC:
+        async with async_engine.begin() as connection:
+            pool_stats.record(time.perf_counter() - start)
+            yield connection
+        return
+
+    transaction = engine.begin()
+    sync_connection: Connection = await run_in_threadpool(transaction.__enter__)
+    pool_stats.record(time.perf_counter() - start)
+    try:
+        yield ThreadedConnection(sync_connection)
+    except BaseException as e:
+        await run_in_threadpool(transaction.__exit__, type(e), e, e.__traceback__)
+        raise
+    await run_in_threadpool(transaction.__exit__, None, None, None)
+
+
+async def copy_from(connection, statement: str, data):
+    """
+    Stream data into a COPY ... FROM STDIN statement on a handler's connection.
+    data is an async iterator of row tuples or chunks of raw COPY input bytes.
+    """
+    if isinstance(connection, ThreadedConnection):
+        # the sync driver can't consume an async iterator from the threadpool, buffer it first
+        items = [item async for item in data]
+
+        def copy():
+            driver_connection = connection.connection.connection.driver_connection
+            assert (
+                driver_connection is not None
+            )  # a checked out connection always has one
+            with driver_connection.cursor() as cursor:
+                with cursor.copy(statement) as writer:
+                    for item in items:
+                        if isinstance(item, bytes):
+                            writer.write(item)
+                        else:
+                            writer.write_row(item)
+
+        await run_in_threadpool(copy)
+        return
+
+    raw_connection = await connection.get_raw_connection()
+    async with raw_connection.driver_connection.cursor() as cursor:
+        async with cursor.copy(statement) as writer:
+            async for item in data:
+                if isinstance(item, bytes):
+                    await writer.write(item)
+                else:
+                    await writer.write_row(item)
@@ -0,0 +1,283 @@
+import bisect
+import contextvars
+import logging
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from sqlalchemy import event
+from src import config
+
+settings = config.get_settings()
+logger = logging.getLogger(__name__)
+
+# latency histogram buckets, in seconds
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+# queries per request histogram buckets
+QUERY_BUCKETS = [1, 2, 3, 5, 10, 25, 50, 100]
+QUANTILES = [0.5, 0.95, 0.99]
+# recent requests kept per route for the quantiles
+WINDOW = 1000
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestStats:
+    """
+    Database work done while handling one request. Unless mode is off, a request
+    running more than budget statements, or the same statement more than
+    repeat_limit times (a query per row, N+1), is logged as a warning or raised.
+    """
+
+    def __init__(
+        self,
+        label: str = "",
+        mode: str = settings.QUERY_CHECK,
+        budget: int = settings.QUERY_BUDGET,
+        repeat_limit: int = settings.QUERY_REPEAT_LIMIT,
+        scope: dict | None = None,
+    ):
+        self.label = label
+        self.scope = scope
+        self.mode = mode
+        self.budget = budget
+        self.repeat_limit = repeat_limit
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements: Counter = Counter()
+        self.reported: set = set()
+
+    def add(self, statement: str, duration: float):
+        self.queries += 1
+        self.db_time += duration
+        if self.mode == "off":
+            return
+
+        self.statements[statement] += 1
+        if self.queries > self.budget and "budget" not in self.reported:
+            self.report(
+                "budget",
+                f"{self.label} ran {self.queries} queries, over the budget of {self.budget}",
+            )
+        if (
+            self.statements[statement] > self.repeat_limit
+            and statement not in self.reported
+        ):
+            shape = " ".join(statement.split())[:200]
+            self.report(
+                statement,
+                f"{self.label} ran the same statement {self.statements[statement]} times, "
+                f"likely a query per row: {shape}",
+            )
+
+    @property
+    def route(self) -> str:
+        # the router leaves the matched route in the scope once it has run
+        if self.scope is None:
+            return self.label
+        route = self.scope.get("route")
+        return f"{self.scope['method']} {route.path}" if route else self.label
+
+    def report(self, key: str, problem: str):
+        # each problem once per request
+        self.reported.add(key)
+        if self.mode == "raise":
+            raise QueryBudgetExceeded(problem)
+        logger.warning(problem)
+
+
+# stats for the request being handled, the engine events add to it
+current_request: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+class Histogram:
+    def __init__(self, buckets: list):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.latency = Histogram(BUCKETS)
+        self.db_time = Histogram(BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.recent: deque[float] = deque(maxlen=WINDOW)
+        self.statuses: dict[int, int] = defaultdict(int)
+
+
+class Metrics:
+    """
+    Request metrics for one worker process, keyed by method and route template
+    """
+
+    def __init__(self):
+        self.routes: dict[tuple[str, str], RouteMetrics] = defaultdict(RouteMetrics)
+        self.in_flight = 0
+
+    def record(
+        self, method: str, route: str, status: int, duration: float, stats: RequestStats
+    ):
+        metrics = self.routes[(method, route)]
+        metrics.latency.observe(duration)
+        metrics.db_time.observe(stats.db_time)
+        metrics.queries.observe(stats.queries)
+        metrics.recent.append(duration)
+        metrics.statuses[status] += 1
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format
+        """
+        lines = [
+            "# HELP http_requests_in_flight Requests being handled right now.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_requests_total Requests handled, by response status.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route), metrics in sorted(self.routes.items()):
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(
+                    f'http_requests_total{{{labels(method, route)},status="{status}"}} {count}'
+                )
+
+        for name, help_text, attribute in [
+            ("http_request_duration_seconds", "Request latency.", "latency"),
+            (
+                "http_request_db_seconds",
+                "Time spent in database queries per request.",
+                "db_time",
+            ),
+            ("http_request_queries", "Database queries run per request.", "queries"),
+        ]:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (method, route), metrics in sorted(self.routes.items()):
+                lines.extend(
+                    histogram_lines(
+                        name, labels(method, route), getattr(metrics, attribute)
+                    )
+                )
+
+        lines.append(
+            "# HELP http_request_duration_quantile_seconds Latency quantiles over each route's recent requests."
+        )
+        lines.append("# TYPE http_request_duration_quantile_seconds gauge")
+        for (method, route), metrics in sorted(self.routes.items()):
+            recent = sorted(metrics.recent)
+            for q in QUANTILES:
+                value = recent[min(int(q * len(recent)), len(recent) - 1)]
+                lines.append(
+                    f'http_request_duration_quantile_seconds{{{labels(method, route)},quantile="{q}"}} {value}'
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+def labels(method: str, route: str) -> str:
+    return f'method="{method}",route="{route}"'
+
+
+def histogram_lines(name: str, label_string: str, histogram: Histogram) -> list:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{label_string},le="{bound}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{label_string}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{label_string}}} {histogram.count}")
+    return lines
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every request and recording it under its route template,
+    so /users/alice and /users/bob both count toward /users/{username}
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(label=f"{scope['method']} {scope['path']}", scope=scope)
+        token = current_request.set(stats)
+        status = 500  # if the app raises before starting a response
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight -= 1
+            current_request.reset(token)
+            # the router leaves the matched route in the scope, unmatched paths share one label
+            route = scope.get("route")
+            metrics.record(
+                scope["method"],
+                route.path if route else "unmatched",
+                status,
+                time.perf_counter() - start,
+                stats,
+            )
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.metrics_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get()
+    if stats is not None:
+        stats.add(statement, time.perf_counter() - context.metrics_start)
+
+
+def instrument(engine):
+    """
+    Count queries and database time for the current request on a sync engine,
+    pass async_engine.sync_engine for the async one
+    """
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+@contextmanager
+def count_queries(
+    mode: str = "raise",
+    budget: int = settings.QUERY_BUDGET,
+    repeat_limit: int = settings.QUERY_REPEAT_LIMIT,
+):
+    """
+    Count the queries run inside the block, for tests calling handlers directly.
+    Raises QueryBudgetExceeded by default, check .queries afterwards for exact counts.
+    """
+    stats = RequestStats(
+        label="block", mode=mode, budget=budget, repeat_limit=repeat_limit
+    )
+    token = current_request.set(stats)
+    try:
+        yield stats
+    finally:
+        current_request.reset(token)
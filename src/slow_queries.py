@@ -0,0 +1,203 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from sqlalchemy import Engine, event
+from src import config
+from src import metrics
+
+settings = config.get_settings()
+logger = logging.getLogger(__name__)
+
+# longest string parameter kept, and most list items shown, in a recorded query
+MAX_VALUE_LENGTH = 64
+MAX_LIST_ITEMS = 10
+# a statement shape is explained at most once this often, in seconds
+EXPLAIN_INTERVAL = 60
+# most statement shapes remembered for that, the longest-ago explained are forgotten first
+EXPLAIN_HISTORY_SIZE = 1000
+# plans waiting for the explain thread, further slow queries aren't explained
+EXPLAIN_QUEUE_SIZE = 100
+# limits for the side transaction, so a plan can't pile onto a struggling database
+EXPLAIN_TIMEOUT = "5s"
+EXPLAIN_LOCK_TIMEOUT = "1s"
+
+
+class SlowQuery:
+    def __init__(
+        self, statement: str, parameters, rows: int, duration: float, route: str
+    ):
+        self.statement = " ".join(statement.split())
+        self.parameters = parameters
+        self.rows = rows  # parameter sets, more than 1 for executemany
+        self.duration = duration
+        self.route = route
+        self.recorded_at = datetime.now(timezone.utc)
+        self.plan: str | None = None  # filled in by the explain thread
+
+
+def redact(parameters, names: set):
+    """
+    Copy of the parameters that is safe to keep around: values of the named parameters
+    are hidden, long strings are cut short and long lists are summarized
+    """
+
+    def value(name, v):
+        if name.lower() in names:
+            return "[redacted]"
+        if isinstance(v, str) and len(v) > MAX_VALUE_LENGTH:
+            return v[:MAX_VALUE_LENGTH] + "..."
+        if isinstance(v, (list, tuple)) and len(v) > MAX_LIST_ITEMS:
+            return f"[{len(v)} items]"
+        return v
+
+    if isinstance(parameters, dict):
+        return {name: value(name, v) for name, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [value("", v) for v in parameters]
+    return parameters
+
+
+class SlowQueryLog:
+    """
+    Ring buffer of the most recent statements slower than the threshold, for one
+    worker process. With explain on, each one's plan is captured by running
+    EXPLAIN on its own connection in a transaction that is rolled back.
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float = settings.SLOW_QUERY_MS,
+        size: int = settings.SLOW_QUERY_LOG_SIZE,
+        explain: bool = settings.SLOW_QUERY_EXPLAIN,
+        redacted: str = settings.SLOW_QUERY_REDACT,
+    ):
+        self.threshold = threshold_ms / 1000
+        self.entries: deque[SlowQuery] = deque(maxlen=size)
+        self.explain = explain
+        self.redact = {
+            name.strip().lower() for name in redacted.split(",") if name.strip()
+        }
+        self.explain_engine: Engine | None = None
+        # statement -> when it was last explained, oldest first
+        self.explained: OrderedDict[str, float] = OrderedDict()
+        self.pending: queue.Queue = queue.Queue(maxsize=EXPLAIN_QUEUE_SIZE)
+        self.explainer: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def record(self, statement: str, parameters, executemany: bool, duration: float):
+        if duration < self.threshold:
+            return
+
+        stats = metrics.current_request.get()
+        if executemany:
+            rows, parameters = len(parameters), parameters[0] if parameters else None
+        else:
+            rows = 1
+        entry = SlowQuery(
+            statement,
+            redact(parameters, self.redact),
+            rows,
+            duration,
+            stats.route if stats else "background",
+        )
+        self.entries.append(entry)
+        logger.warning(
+            "slow query, %.1fms in %s: %s",
+            duration * 1000,
+            entry.route,
+            entry.statement[:200],
+        )
+
+        if self.explain and self.explain_engine is not None:
+            self.queue_explain(entry, statement, parameters)
+
+    def queue_explain(self, entry: SlowQuery, statement: str, parameters):
+        now = time.monotonic()
+        with self.lock:
+            if (
+                now - self.explained.get(entry.statement, -EXPLAIN_INTERVAL)
+                < EXPLAIN_INTERVAL
+            ):
+                return
+            self.explained[entry.statement] = now
+            self.explained.move_to_end(entry.statement)
+            # anything explained longer than the interval ago would be explained again anyway
+            while self.explained:
+                statement_shape, explained_at = next(iter(self.explained.items()))
+                if (
+                    now - explained_at < EXPLAIN_INTERVAL
+                    and len(self.explained) <= EXPLAIN_HISTORY_SIZE
+                ):
+                    break
+                del self.explained[statement_shape]
+            if self.explainer is None:
+                self.explainer = threading.Thread(
+                    target=self.run_explainer, name="slow-query-explain", daemon=True
+                )
+                self.explainer.start()
+        try:
+            # explained after the fact - the caller's transaction may still hold locks the plan would wait on
+            self.pending.put_nowait((entry, statement, parameters))
+        except queue.Full:
+            entry.plan = "not explained, too many slow queries waiting"
+
+    def run_explainer(self):
+        while True:
+            entry, statement, parameters = self.pending.get()
+            entry.plan = self.explain_plan(statement, parameters)
+
+    def explain_plan(self, statement: str, parameters) -> str:
+        # ANALYZE runs the statement, so only reads get it - writes are planned without running them
+        read_only = statement.lstrip().upper().startswith("SELECT")
+        options = "ANALYZE, BUFFERS" if read_only else "COSTS"
+        if self.explain_engine is None:
+            return "not explained, no engine to explain on"
+        # a raw driver connection, so the plan isn't counted or logged as a query itself
+        connection = self.explain_engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"SET LOCAL statement_timeout = '{EXPLAIN_TIMEOUT}'")
+            cursor.execute(f"SET LOCAL lock_timeout = '{EXPLAIN_LOCK_TIMEOUT}'")
+            cursor.execute(f"EXPLAIN ({options}) {statement}", parameters)
+            return "\n".join(row[0] for row in cursor.fetchall())
+        except Exception as e:
+            return f"could not explain: {e}"
+        finally:
+            connection.rollback()
+            connection.close()
+
+    def clear(self):
+        self.entries.clear()
+        with self.lock:
+            self.explained.clear()
+
+
+log = SlowQueryLog()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.slow_query_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    log.record(
+        statement,
+        parameters,
+        executemany,
+        time.perf_counter() - context.slow_query_start,
+    )
+
+
+def instrument(engine: Engine, explain_engine: Engine):
+    """
+    Record slow statements run on a sync engine, pass async_engine.sync_engine for the async one.
+    Plans are captured on explain_engine, which must be a sync engine.
+    """
+    if not settings.SLOW_QUERY_ENABLED:
+        return
+    log.explain_engine = explain_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
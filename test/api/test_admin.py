@@ -0,0 +1,167 @@
+import anyio
+import pytest
+from fastapi import HTTPException
+import sqlalchemy
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from src.api.admin import (
+    cache_status,
+    clear_slow_queries,
+    get_slow_queries,
+    pool_status,
+    reset,
+)
+from src.api.users import add_to_watchlist, search_users, view_user
+from src import database as db
+from src import slow_queries
+
+
+@pytest.mark.anyio
+async def test_pool_status(monkeypatch):
+    checkouts = db.pool_stats.checkouts
+
+    # one checkout, whatever is in the users table
+    with pytest.raises(HTTPException) as exception:
+        await view_user("poolstatusnobody")
+    assert exception.value.status_code == 404
+
+    status = await pool_status()
+    assert status.checkouts == checkouts + 1
+    assert status.checked_out == 0
+    assert status.idle is not None and status.idle >= 1
+    assert status.max_checkout_wait_ms >= status.average_checkout_wait_ms > 0
+
+    # pools that don't count their connections report the class and nothing else
+    monkeypatch.setattr(db.settings, "DB_ASYNC", True)
+    monkeypatch.setattr(
+        db, "async_engine", create_async_engine(db.connection_url, poolclass=NullPool)
+    )
+    status = await pool_status()
+    assert status.pool == "NullPool"
+    assert (
+        status.pool_size is None
+        and status.checked_out is None
+        and status.overflow is None
+    )
+
+
+@pytest.mark.anyio
+async def test_reset():
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO users (username) VALUES ('resetuser1'), ('resetuser2')"
+            )
+        )
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO media (media_type, title, director) VALUES ('movie', 'resetmovie', 'director')"
+            )
+        )
+        connection.execute(
+            sqlalchemy.text(
+                """
+            INSERT INTO reviews (user_id, media_id, rating, review)
+            SELECT u.id, m.media_id, 3, 'ok' FROM users u, media m
+            WHERE u.username IN ('resetuser1', 'resetuser2') AND m.title = 'resetmovie'
+            """
+            )
+        )
+
+    await reset(rebuild=True)
+
+    with db.engine.begin() as connection:
+        counts = connection.execute(
+            sqlalchemy.text(
+                """
+            SELECT (SELECT COUNT(*) FROM users) + (SELECT COUNT(*) FROM media)
+                 + (SELECT COUNT(*) FROM reviews) + (SELECT COUNT(*) FROM media_rating_stats)
+            """
+            )
+        ).scalar_one()
+        # identities restart
+        user_id = connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO users (username) VALUES ('resetuser3') RETURNING id"
+            )
+        ).scalar_one()
+        connection.execute(sqlalchemy.text("TRUNCATE users CASCADE"))
+    assert counts == 0
+    assert user_id == 1
+
+
+@pytest.mark.anyio
+async def test_cache_status():
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("INSERT INTO users (username) VALUES ('cacheuser')")
+        )
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO media (media_type, title, director) VALUES ('movie', 'cachemovie', 'director')"
+            )
+        )
+
+    before = await cache_status()
+    assert (await view_user("cacheuser")).size_of_watchlist == 0
+    assert (await view_user("cacheuser")).size_of_watchlist == 0
+
+    status = await cache_status()
+    assert status.misses == before.misses + 1
+    assert status.hits == before.hits + 1
+    assert status.entries == 1
+
+    # adding to the watchlist invalidates the cached profile
+    await add_to_watchlist("cacheuser", "cachemovie")
+    assert (await view_user("cacheuser")).size_of_watchlist == 1
+
+    status = await cache_status()
+    assert status.invalidations == before.invalidations + 1
+    assert status.misses == before.misses + 2
+
+    await reset()
+    assert (await cache_status()).entries == 0
+
+
+@pytest.mark.anyio
+async def test_slow_queries(monkeypatch):
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("INSERT INTO users (username) VALUES ('slowuser')")
+        )
+
+    # every statement counts as slow
+    monkeypatch.setattr(slow_queries.log, "threshold", 0)
+    monkeypatch.setattr(slow_queries.log, "explain", True)
+    monkeypatch.setattr(slow_queries.log, "redact", {"username"})
+    await clear_slow_queries()
+
+    await search_users("slow")
+
+    entries = await get_slow_queries()
+    search = next(entry for entry in entries if "LIKE" in entry.statement)
+    assert search.parameters["username"] == "[redacted]"
+    assert search.route == "background"  # called directly, outside a request
+    assert [
+        entry.duration_ms for entry in await get_slow_queries(order="slowest")
+    ] == sorted((entry.duration_ms for entry in entries), reverse=True)
+
+    # plans are captured in the background
+    for _ in range(50):
+        plan = next(
+            entry for entry in await get_slow_queries() if "LIKE" in entry.statement
+        ).plan
+        if plan:
+            break
+        await anyio.sleep(0.1)
+    assert "actual time" in plan
+
+    await clear_slow_queries()
+    assert await get_slow_queries() == []
+
+    with pytest.raises(HTTPException) as exception:
+        await get_slow_queries(order="fastest")
+    assert exception.value.status_code == 400
+
+    with db.engine.begin() as connection:
+        connection.execute(sqlalchemy.text("TRUNCATE users CASCADE"))
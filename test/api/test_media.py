@@ -1,41 +1,70 @@
+import anyio
+import json
 import pytest
-from src.api.users import create_new_user, add_to_watchlist, get_watchlist, mark_as_watched
+from fastapi import Response
+from src.api.users import (
+    create_new_user,
+    add_to_watchlist,
+    get_watchlist,
+    mark_as_watched,
+)
 from src.api.media import *
+from src.api.admin import reset
 import sqlalchemy
-from src.api import auth
+from src.api import auth, media
 from src import database as db
+from src import cache
+from src.metrics import count_queries
+from src.api.pagination import encode_cursor
 
-def test_post_review() -> None:
+
+@pytest.mark.anyio
+async def test_post_review() -> None:
     with db.engine.begin() as connection:
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE users RESTART IDENTITY CASCADE"))
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE"))
-        connection.execute(sqlalchemy.text("INSERT INTO media VALUES (1,'movie','media1','director1')"))
-        connection.execute(sqlalchemy.text("INSERT INTO media VALUES (2,'movie','media2','director2')"))
-    create_new_user("USER1")
-    create_new_user("USER2")    
-    review1 = MediaReview(username = "USER1",review = "good",rating = 4)
-    review2 = MediaReview(username = "USER2",review = "bad",rating = 1)
-    review3 = MediaReview(username = "USER2",review = "changed mind",rating = 5)
-    review_media(1,review1)
-    review_media(1,review2)
-    review_media(1,review3)
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE users RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (1,'movie','media1','director1')")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (2,'movie','media2','director2')")
+        )
+    await create_new_user("USER1")
+    await create_new_user("USER2")
+    review1 = MediaReview(username="USER1", review="good", rating=4)
+    review2 = MediaReview(username="USER2", review="bad", rating=1)
+    review3 = MediaReview(username="USER2", review="changed mind", rating=5)
+    await review_media("media1", review1)
+    await review_media("media1", review2)
+    await review_media("media1", review3)
 
     with db.engine.begin() as connection:
-        result = connection.execute(
-            sqlalchemy.text("SELECT * FROM reviews")
-        ).fetchall()
+        result = connection.execute(sqlalchemy.text("SELECT * FROM reviews")).fetchall()
 
     ratings = [row.rating for row in result]
     reviews = [row.review for row in result]
-    assert ratings == [4.0,5.0]
-    assert reviews == ['good', 'changed mind']
+    assert ratings == [4.0, 5.0]
+    assert reviews == ["good", "changed mind"]
+
 
-def test_post_film() -> None:
+@pytest.mark.anyio
+async def test_post_film() -> None:
     with db.engine.begin() as connection:
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE"))
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE movies RESTART IDENTITY CASCADE"))
-    post_film("MOVIE1","DIRECTOR1",60)
-    post_film("MOVIE2","DIRECTOR2",120)
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE movies RESTART IDENTITY CASCADE")
+        )
+    # one statement for media and movies, plus the cache invalidation
+    with count_queries() as stats:
+        await post_film(FilmSubmission(title="MOVIE1", director="DIRECTOR1", length=60))
+    assert stats.queries <= 2
+    await post_film(FilmSubmission(title="MOVIE2", director="DIRECTOR2", length=120))
     with db.engine.begin() as connection:
         media_result = connection.execute(
             sqlalchemy.text("SELECT * FROM media")
@@ -48,20 +77,35 @@ def test_post_film() -> None:
     media_titles = [row.title for row in media_result]
     movie_lengths = [row.length for row in movie_result]
 
-    assert media_ids == [1,2]
-    assert media_titles == ["MOVIE1","MOVIE2"]
-    assert movie_lengths == [60,120]
+    assert media_ids == [1, 2]
+    assert media_titles == ["MOVIE1", "MOVIE2"]
+    assert movie_lengths == [60, 120]
     with pytest.raises(HTTPException) as exception:
-        post_film("MOVIE1","DIRECTOR1",60)
+        await post_film(FilmSubmission(title="MOVIE1", director="DIRECTOR1", length=60))
+    assert exception.value.status_code == 409
+    # titles are unique across movies and shows
+    with pytest.raises(HTTPException) as exception:
+        await post_show(
+            ShowSubmission(title="MOVIE2", director="DIRECTOR2", seasons=1, episodes=10)
+        )
     assert exception.value.status_code == 409
 
 
-def test_post_show() -> None:
+@pytest.mark.anyio
+async def test_post_show() -> None:
     with db.engine.begin() as connection:
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE"))
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE tv_shows RESTART IDENTITY CASCADE"))
-    post_show("TVSHOW1","DIRECTOR1",5,100)
-    post_show("TVSHOW2","DIRECTOR2",1,12)
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE tv_shows RESTART IDENTITY CASCADE")
+        )
+    await post_show(
+        ShowSubmission(title="TVSHOW1", director="DIRECTOR1", seasons=5, episodes=100)
+    )
+    await post_show(
+        ShowSubmission(title="TVSHOW2", director="DIRECTOR2", seasons=1, episodes=12)
+    )
     with db.engine.begin() as connection:
         media_result = connection.execute(
             sqlalchemy.text("SELECT * FROM media")
@@ -74,12 +118,578 @@ def test_post_show() -> None:
     media_titles = [row.title for row in media_result]
     tv_seasons = [row.total_seasons for row in tv_result]
     tv_episodes = [row.total_episodes for row in tv_result]
-    assert media_ids == [1,2]
-    assert media_titles == ["TVSHOW1","TVSHOW2"]
-    assert tv_seasons == [5,1]
-    assert tv_episodes == [100,12]
+    assert media_ids == [1, 2]
+    assert media_titles == ["TVSHOW1", "TVSHOW2"]
+    assert tv_seasons == [5, 1]
+    assert tv_episodes == [100, 12]
 
     with pytest.raises(HTTPException) as exception:
-        post_show("TVSHOW1","DIRECTOR1",5,100)
+        await post_show(
+            ShowSubmission(
+                title="TVSHOW1", director="DIRECTOR1", seasons=5, episodes=100
+            )
+        )
     assert exception.value.status_code == 409
-    
\ No newline at end of file
+
+
+@pytest.mark.anyio
+async def test_get_recommendations() -> None:
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE users RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (1,'movie','media1','director1')")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (2,'movie','media2','director2')")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (3,'show','media3','director3')")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (4,'show','media4','director4')")
+        )
+    for username in ["USER1", "USER2", "USER3"]:
+        await create_new_user(username)
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("INSERT INTO friendships VALUES (1,2),(1,3)")
+        )
+        connection.execute(
+            sqlalchemy.text(
+                """
+            INSERT INTO watchlists (user_id, media_id, have_watched) VALUES
+            (1,1,false),
+            (2,1,true),(2,2,true),(2,3,false),
+            (3,2,true),(3,3,true),(3,4,false)
+            """
+            )
+        )
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO reviews VALUES (2,3,5,'great'),(3,3,4,'good'),(3,2,1,'bad')"
+            )
+        )
+
+    recommendations = await get_recommendations("USER1")
+    assert [rec.title for rec in recommendations] == ["media3", "media2", "media4"]
+    assert [rec.friend_count for rec in recommendations] == [2, 2, 1]
+    assert recommendations[0].score > recommendations[1].score
+
+    assert len(await get_recommendations("USER1", limit=1)) == 1
+    assert await get_recommendations("USER2") == []
+    with pytest.raises(HTTPException) as exception:
+        await get_recommendations("NOBODY")
+    assert exception.value.status_code == 404
+
+    with db.engine.begin() as connection:
+        # tear down
+        connection.execute(
+            sqlalchemy.text(
+                """
+                TRUNCATE movies, tv_shows, media, watchlists, users, reviews CASCADE
+                """
+            )
+        )
+
+
+@pytest.mark.anyio
+async def test_search_media() -> None:
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO media VALUES (1,'movie','The Dunes of Arrakis','director1')"
+            )
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (2,'movie','Dune','director2')")
+        )
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO media VALUES (3,'show','Dune Prophecy','director3')"
+            )
+        )
+
+    # case-insensitive substring match, closest title first
+    assert await search_media("dune", "movie") == ["Dune", "The Dunes of Arrakis"]
+
+    with pytest.raises(HTTPException) as exception:
+        await search_media("arrakis", "show")
+    assert exception.value.status_code == 404
+
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+
+
+@pytest.mark.anyio
+async def test_review_media_updates_rating_stats() -> None:
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE users RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (1,'movie','media1','director1')")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (2,'movie','media2','director2')")
+        )
+    await create_new_user("USER1")
+    await create_new_user("USER2")
+
+    await review_media("media1", MediaReview(username="USER1", review="good", rating=4))
+    await review_media("media1", MediaReview(username="USER2", review="bad", rating=1))
+    # replacing a review only applies the difference
+    await review_media(
+        "media1", MediaReview(username="USER2", review="changed mind", rating=5)
+    )
+
+    with db.engine.begin() as connection:
+        stats = connection.execute(
+            sqlalchemy.text(
+                "SELECT review_count, rating_sum FROM media_rating_stats WHERE media_id = 1"
+            )
+        ).one()
+    assert stats.review_count == 2
+    assert stats.rating_sum == 9.0
+
+    media = (await view_media(Response())).items
+    assert [(m.title, m.average_rating) for m in media] == [
+        ("media1", 4.5),
+        ("media2", 0),
+    ]
+
+    first_page = await view_media(Response(), limit=1)
+    assert [m.title for m in first_page.items] == ["media1"]
+    second_page = await view_media(Response(), limit=1, cursor=first_page.next_cursor)
+    assert [m.title for m in second_page.items] == ["media2"]
+    assert second_page.next_cursor is None
+
+    first_page = await view_reviews("media1", Response(), limit=1)
+    assert [r.username for r in first_page.items] == ["USER1"]
+    second_page = await view_reviews(
+        "media1", Response(), limit=1, cursor=first_page.next_cursor
+    )
+    assert [r.username for r in second_page.items] == ["USER2"]
+    assert second_page.next_cursor is None
+    with pytest.raises(HTTPException) as exception:
+        await view_reviews("media1", Response(), cursor=encode_cursor(["USER1"]))
+    assert exception.value.status_code == 400
+
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text(
+                """
+                TRUNCATE movies, tv_shows, media, watchlists, users, reviews CASCADE
+                """
+            )
+        )
+
+
+@pytest.mark.anyio
+async def test_concurrent_reviews_keep_rating_stats() -> None:
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE users RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (1,'movie','media1','director1')")
+        )
+    await create_new_user("USER1")
+    await create_new_user("USER2")
+
+    # racing first reviews from the same user must count once, whichever lands first
+    async with anyio.create_task_group() as tasks:
+        for rating in [1, 2, 3, 4, 5] * 2:
+            for username in ["USER1", "USER2"]:
+                tasks.start_soon(
+                    review_media,
+                    "media1",
+                    MediaReview(username=username, review="again", rating=rating),
+                )
+
+    with db.engine.begin() as connection:
+        stats = connection.execute(
+            sqlalchemy.text(
+                "SELECT review_count, rating_sum FROM media_rating_stats WHERE media_id = 1"
+            )
+        ).one()
+        reviews = connection.execute(
+            sqlalchemy.text(
+                "SELECT COUNT(*) AS review_count, SUM(rating) AS rating_sum FROM reviews WHERE media_id = 1"
+            )
+        ).one()
+        connection.execute(sqlalchemy.text("TRUNCATE media, users, reviews CASCADE"))
+    assert tuple(stats) == tuple(reviews) == (2, reviews.rating_sum)
+
+
+@pytest.mark.anyio
+async def test_view_media_filters() -> None:
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (1,'movie','Alpha','Nolan')")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (2,'show','Beta','Nolan')")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (3,'movie','Gamma','Lee')")
+        )
+
+    async def titles(**filters):
+        return [m.title for m in (await view_media(Response(), **filters)).items]
+
+    assert await titles() == ["Alpha", "Beta", "Gamma"]
+    assert await titles(media_title="alp") == ["Alpha"]
+    assert await titles(director="nol") == ["Alpha", "Beta"]
+    assert await titles(media_type="SHOW") == ["Beta"]
+    assert await titles(director="nol", media_type="movie") == ["Alpha"]
+
+    # highest rated first, ties in media_id order, then titles nobody has reviewed
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (4,'movie','Delta','Lee')")
+        )
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO media_rating_stats VALUES (2,2,6), (3,1,4), (4,1,4)"
+            )
+        )
+    cache.cache.clear()
+    pages, cursor = [], None
+    while True:
+        page = await view_media(Response(), limit=1, cursor=cursor)
+        pages.append([(m.title, m.average_rating) for m in page.items])
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+    assert pages == [
+        [("Gamma", 4.0)],
+        [("Delta", 4.0)],
+        [("Beta", 3.0)],
+        [("Alpha", 0.0)],
+    ]
+
+    # cursors from before pages were keyed on media_id
+    with pytest.raises(HTTPException) as exception:
+        await view_media(Response(), cursor=encode_cursor([4.0, "Gamma"]))
+    assert exception.value.status_code == 400
+
+    with db.engine.begin() as connection:
+        connection.execute(sqlalchemy.text("TRUNCATE media CASCADE"))
+
+
+@pytest.mark.anyio
+async def test_conditional_reads() -> None:
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE users RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (1,'movie','media1','director1')")
+        )
+    await create_new_user("USER1")
+    await review_media("media1", MediaReview(username="USER1", review="good", rating=4))
+
+    response = Response()
+    await view_media(response)
+    catalog_etag = response.headers["ETag"]
+    response = Response()
+    await view_reviews("media1", response)
+    reviews_etag = response.headers["ETag"]
+
+    # served from the cache, then with the cache empty only the version query runs
+    for clear in (False, True):
+        if clear:
+            cache.cache.clear()
+        not_modified = await view_media(Response(), if_none_match=catalog_etag)
+        assert not_modified.status_code == 304
+        assert not_modified.headers["ETag"] == catalog_etag
+        not_modified = await view_reviews(
+            "media1",
+            Response(),
+            if_none_match=f'"other", {reviews_etag.removeprefix("W/")}',
+        )
+        assert not_modified.status_code == 304
+
+    # other parameters are a different representation
+    response = Response()
+    page = await view_media(response, limit=1, if_none_match=catalog_etag)
+    assert [m.title for m in page.items] == ["media1"]
+    assert response.headers["ETag"] != catalog_etag
+
+    # a new review changes both
+    await review_media(
+        "media1", MediaReview(username="USER1", review="better", rating=5)
+    )
+    response = Response()
+    page = await view_media(response, if_none_match=catalog_etag)
+    assert page.items[0].average_rating == 5
+    assert response.headers["ETag"] != catalog_etag
+    response = Response()
+    page = await view_reviews("media1", response, if_none_match=reviews_etag)
+    assert page.items[0].review == "better"
+    assert response.headers["ETag"] != reviews_etag
+
+    # so does emptying the catalog, even with nothing left to stamp
+    response = Response()
+    await view_media(response)
+    catalog_etag = response.headers["ETag"]
+    await reset()
+    response = Response()
+    page = await view_media(response, if_none_match=catalog_etag)
+    assert page.items == []
+    assert response.headers["ETag"] != catalog_etag
+
+
+def test_review_media_bulk() -> None:
+    from fastapi.testclient import TestClient
+    from src.api.server import app
+
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE users RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (1,'movie','media1','director1')")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media VALUES (2,'movie','media2','director2')")
+        )
+        connection.execute(
+            sqlalchemy.text("INSERT INTO users (username) VALUES ('USER1'), ('USER2')")
+        )
+        connection.execute(sqlalchemy.text("INSERT INTO reviews VALUES (1,1,2,'meh')"))
+        connection.execute(
+            sqlalchemy.text("INSERT INTO media_rating_stats VALUES (1,1,2)")
+        )
+
+    client = TestClient(app)
+    headers = {"access_token": auth.api_key}
+
+    body = "\n".join(
+        [
+            '{"username": "USER1", "title": "media1", "rating": 4, "review": "better on rewatch"}',
+            '{"username": "USER2", "title": "media1", "rating": 1, "review": "bad"}',
+            "",
+            "not json",
+            '{"username": "NOBODY", "title": "media1", "rating": 3, "review": "ok"}',
+            '{"username": "USER2", "title": "media1", "rating": 9, "review": "too high"}',
+            '{"username": "USER2", "title": "media2", "rating": 3, "review": "first"}',
+            '{"username": "USER2", "title": "media2", "rating": 5, "review": "second"}',
+            '{"username": "USER1", "title": "media2", "rating": 2, "review": "nul \\u0000"}',
+        ]
+    )
+    response = client.post(
+        "/media/reviews/bulk",
+        content=body,
+        headers={**headers, "content-type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert result["received"] == 8
+    assert result["merged"] == 3
+    # rows are numbered by line, counting the blank one
+    assert [(r["row"], r["reason"]) for r in result["rejected"]] == [
+        (4, "invalid JSON"),
+        (5, "user not found"),
+        (6, "rating must be between 1 and 5"),
+        (7, "replaced by a later row for the same user and title"),
+        (9, "contains a NUL character"),
+    ]
+
+    response = client.post(
+        "/media/reviews/bulk",
+        content='username,title,rating,review\nUSER1,media2,"1","so, so bad"\n',
+        headers={**headers, "content-type": "text/csv"},
+    )
+    assert response.json()["merged"] == 1
+
+    # a row COPY can't parse refuses the whole body, naming its line
+    for bad_body, reason in (
+        (
+            "username,title,rating,review\nUSER1,media2,1,ok\nUSER1,media2,1\n",
+            "line 3: missing data",
+        ),
+        (
+            "username,title,rating,review\nUSER1,media2,1,ok,extra\n",
+            "line 2: extra data",
+        ),
+        ("username,title,rating,review\nUSER1,media2,1,o\x00k\n", "line 2: "),
+    ):
+        response = client.post(
+            "/media/reviews/bulk",
+            content=bad_body,
+            headers={**headers, "content-type": "text/csv"},
+        )
+        assert response.status_code == 400
+        assert reason in response.json()["detail"]
+
+    with db.engine.begin() as connection:
+        stats = connection.execute(
+            sqlalchemy.text(
+                "SELECT media_id, review_count, rating_sum FROM media_rating_stats ORDER BY media_id"
+            )
+        ).fetchall()
+        reviews = connection.execute(
+            sqlalchemy.text(
+                "SELECT user_id, media_id, rating, review FROM reviews ORDER BY media_id, user_id"
+            )
+        ).fetchall()
+    assert [tuple(row) for row in stats] == [(1, 2, 5.0), (2, 2, 6.0)]
+    assert [tuple(row) for row in reviews] == [
+        (1, 1, 4.0, "better on rewatch"),
+        (2, 1, 1.0, "bad"),
+        (1, 2, 1.0, "so, so bad"),
+        (2, 2, 5.0, "second"),
+    ]
+
+    assert client.post("/media/reviews/bulk", content=body).status_code == 401
+
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text(
+                """
+                TRUNCATE movies, tv_shows, media, watchlists, users, reviews CASCADE
+                """
+            )
+        )
+
+
+def test_post_catalog_bulk(monkeypatch) -> None:
+    from fastapi.testclient import TestClient
+    from src.api.server import app
+
+    with db.engine.begin() as connection:
+        connection.execute(
+            sqlalchemy.text("TRUNCATE TABLE media RESTART IDENTITY CASCADE")
+        )
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO media (media_type, title, director) VALUES ('movie', 'existing', 'director')"
+            )
+        )
+
+    client = TestClient(app)
+    headers = {"access_token": auth.api_key}
+
+    response = client.post(
+        "/media/catalog/bulk",
+        headers=headers,
+        json=[
+            {"title": "film1", "director": "director1", "length": 90},
+            {"title": "show1", "director": "director2", "seasons": 2, "episodes": 16},
+            {"title": "existing", "director": "director", "length": 100},
+            {"title": "film1", "director": "someone else", "length": 80},
+            {"title": "film2", "director": "director3", "length": 0},
+            {"title": "untyped", "director": "director4"},
+            {"title": "both", "director": "director5", "length": 90, "seasons": 1},
+        ],
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["received"], result["inserted"], result["rejected_count"]) == (
+        7,
+        2,
+        5,
+    )
+    assert [(r["row"], r["title"], r["reason"]) for r in result["rejected"]] == [
+        (3, "existing", "already exists"),
+        (4, "film1", "listed earlier in the upload"),
+        (5, "film2", "length: Input should be greater than 0"),
+        (6, "untyped", "must have a length, or seasons and episodes"),
+        (
+            7,
+            "both",
+            "has both a length and seasons or episodes, can't tell a film from a show",
+        ),
+    ]
+
+    body = "\n".join(
+        [
+            '{"title": "show2", "director": "director5", "seasons": 1, "episodes": 8}',
+            "",
+            "not json",
+            '{"title": "show1", "director": "director2", "seasons": 2, "episodes": 16}',
+        ]
+    )
+    response = client.post(
+        "/media/catalog/bulk",
+        content=body,
+        headers={**headers, "content-type": "application/x-ndjson"},
+    )
+    result = response.json()
+    assert result["inserted"] == 1
+    assert [(r["row"], r["reason"]) for r in result["rejected"]] == [
+        (3, "invalid JSON"),
+        (4, "already exists"),
+    ]
+
+    with db.engine.begin() as connection:
+        movies = connection.execute(
+            sqlalchemy.text(
+                "SELECT title, length FROM media JOIN movies USING (media_id) ORDER BY title"
+            )
+        ).fetchall()
+        shows = connection.execute(
+            sqlalchemy.text(
+                "SELECT title, total_seasons, total_episodes FROM media JOIN tv_shows USING (media_id) ORDER BY title"
+            )
+        ).fetchall()
+    assert [tuple(row) for row in movies] == [("film1", 90)]
+    assert [tuple(row) for row in shows] == [("show1", 2, 16), ("show2", 1, 8)]
+
+    assert client.post("/media/catalog/bulk", json=[]).status_code == 401
+    assert (
+        client.post(
+            "/media/catalog/bulk",
+            content="film1",
+            headers={**headers, "content-type": "text/plain"},
+        ).status_code
+        == 415
+    )
+
+    # oversized bodies are refused before they are parsed, whether or not they say how big they are
+    monkeypatch.setattr(media, "MAX_CATALOG_BYTES", 100)
+    films = [
+        {"title": f"big{i}", "director": "director", "length": 90} for i in range(10)
+    ]
+    assert (
+        client.post("/media/catalog/bulk", headers=headers, json=films).status_code
+        == 413
+    )
+    chunked = (line.encode() + b"\n" for line in map(json.dumps, films))
+    assert (
+        client.post(
+            "/media/catalog/bulk",
+            content=chunked,
+            headers={**headers, "content-type": "application/x-ndjson"},
+        ).status_code
+        == 413
+    )
+
+    with db.engine.begin() as connection:
+        connection.execute(sqlalchemy.text("TRUNCATE movies, tv_shows, media CASCADE"))
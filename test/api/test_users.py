@@ -1,36 +1,53 @@
-from src.api.users import create_new_user, add_to_watchlist, get_watchlist, mark_as_watched
+import pytest
+from fastapi import HTTPException
+from src.api.users import (
+    create_new_user,
+    add_to_watchlist,
+    add_to_watchlist_bulk,
+    WatchlistImportItem,
+    get_watchlist,
+    get_watchlist_summary,
+    mark_as_watched,
+    get_suggested_friends,
+    add_friend,
+    remove_friend,
+    get_followers,
+    Username,
+    search_users,
+    view_user,
+)
+import json
 import sqlalchemy
 from src.api import auth
+from src.api.pagination import encode_cursor
 from src import database as db
+from src.metrics import count_queries
 
 
-
-def test_users():
+@pytest.mark.anyio
+async def test_users():
     # clear users table before testing
     with db.engine.begin() as connection:
         connection.execute(sqlalchemy.text("DELETE FROM users"))
 
-
-    response = create_new_user("testuser")
+    response = await create_new_user("testuser")
 
     with db.engine.begin() as connection:
         result = connection.execute(
             sqlalchemy.text("SELECT username FROM users WHERE username = :username"),
-            {"username": "testuser"}
+            {"username": "testuser"},
         ).one()
 
     assert result.username == "testuser"
 
     # should raise an HTTPException with status code 409
-    try:
-        create_new_user("testuser")
-    except Exception as e:
-        assert e.status_code == 409
-
-    create_new_user("testuser3")
-    create_new_user("testuser4")
-    create_new_user("testuser5")
+    with pytest.raises(HTTPException) as exception:
+        await create_new_user("testuser")
+    assert exception.value.status_code == 409
 
+    await create_new_user("testuser3")
+    await create_new_user("testuser4")
+    await create_new_user("testuser5")
 
     with db.engine.begin() as connection:
         result = connection.execute(
@@ -40,12 +57,12 @@ def test_users():
     usernames = set([row.username for row in result])
 
     assert usernames == {"testuser", "testuser3", "testuser4", "testuser5"}
-    
 
-    
-def test_add_to_watchlist():
+
+@pytest.mark.anyio
+async def test_add_to_watchlist():
     # create a new user
-    create_new_user("testuser33")
+    await create_new_user("testuser33")
 
     # insert a media item into the media table
     with db.engine.begin() as connection:
@@ -56,11 +73,7 @@ def test_add_to_watchlist():
                 RETURNING media_id
                 """
             ),
-            {
-                "media_type": "movie",
-                "title": "Test Movie",
-                "director": "Test Director"
-            }
+            {"media_type": "movie", "title": "Test Movie", "director": "Test Director"},
         ).scalar_one()
 
         connection.execute(
@@ -69,14 +82,11 @@ def test_add_to_watchlist():
                 INSERT INTO movies (media_id, length) VALUES (:media_id, :length)
                 """
             ),
-            {
-                "media_id": media_id,
-                "length": 120
-            }
+            {"media_id": media_id, "length": 120},
         )
 
     # add to watchlist
-    add_to_watchlist("testuser", "Test Movie", have_watched=False)
+    await add_to_watchlist("testuser", "Test Movie", have_watched=False)
 
     # check if the entry was added to the watchlist
     with db.engine.begin() as connection:
@@ -88,10 +98,7 @@ def test_add_to_watchlist():
                 AND media_id = :media_id
                 """
             ),
-            {
-                "username": "testuser",
-                "media_id": media_id
-            }
+            {"username": "testuser", "media_id": media_id},
         ).fetchone()
 
     assert result is not None
@@ -105,9 +112,7 @@ def test_add_to_watchlist():
                 DELETE FROM movies WHERE media_id = :media_id
                 """
             ),
-            {
-                "media_id": media_id
-            }
+            {"media_id": media_id},
         )
         # delete the movie watchlist
         connection.execute(
@@ -117,10 +122,7 @@ def test_add_to_watchlist():
                 AND media_id = :media_id
                 """
             ),
-            {
-                "username": "testuser",
-                "media_id": media_id
-            }
+            {"username": "testuser", "media_id": media_id},
         )
         # delete the user from the users table
         connection.execute(
@@ -129,9 +131,7 @@ def test_add_to_watchlist():
                 DELETE FROM users WHERE username = :username
                 """
             ),
-            {
-                "username": "testuser"
-            }
+            {"username": "testuser"},
         )
         # delete the media from the media table
         connection.execute(
@@ -140,15 +140,14 @@ def test_add_to_watchlist():
                 DELETE FROM media WHERE media_id = :media_id
                 """
             ),
-            {
-                "media_id": media_id
-            }
+            {"media_id": media_id},
         )
 
 
-def test_add_to_watchlist_invalid_user():
+@pytest.mark.anyio
+async def test_add_to_watchlist_invalid_user():
     # add testuser to the database
-    create_new_user("TestAddUser")
+    await create_new_user("TestAddUser")
 
     # add Test Movie to the media table
     with db.engine.begin() as connection:
@@ -159,11 +158,7 @@ def test_add_to_watchlist_invalid_user():
                 RETURNING media_id
                 """
             ),
-            {
-                "media_type": "movie",
-                "title": "Test Movie",
-                "director": "Test Director"
-            }
+            {"media_type": "movie", "title": "Test Movie", "director": "Test Director"},
         ).scalar_one()
 
         connection.execute(
@@ -172,23 +167,18 @@ def test_add_to_watchlist_invalid_user():
                 INSERT INTO movies (media_id, length) VALUES (:media_id, :length)
                 """
             ),
-            {
-                "media_id": media_id,
-                "length": 120
-            }
+            {"media_id": media_id, "length": 120},
         )
 
         # try to add to watchlist with invalid user
-        try:
-            add_to_watchlist("invaliduser", "Test Movie", have_watched=False)
-        except Exception as e:
-            assert e.status_code == 404
+        with pytest.raises(HTTPException) as exception:
+            await add_to_watchlist("invaliduser", "Test Movie", have_watched=False)
+        assert exception.value.status_code == 404
 
         # try to add to watchlist with invalid media
-        try:
-            add_to_watchlist("testuser", "Invalid Movie", have_watched=False)
-        except Exception as e:
-            assert e.status_code == 404
+        with pytest.raises(HTTPException) as exception:
+            await add_to_watchlist("testuser", "Invalid Movie", have_watched=False)
+        assert exception.value.status_code == 404
 
         # tear down
         connection.execute(
@@ -200,17 +190,12 @@ def test_add_to_watchlist_invalid_user():
         )
 
 
-
-
-
-
-
-
-def test_get_watchlist():
+@pytest.mark.anyio
+async def test_get_watchlist():
     # create a new user
-    create_new_user("testuser44")
+    await create_new_user("testuser44")
 
-    movies = ['testmovie1', 'testmovie2', 'testmovie3', 'testmovie4', 'testmovie5']
+    movies = ["testmovie1", "testmovie2", "testmovie3", "testmovie4", "testmovie5"]
     # add Test Movie to db
     with db.engine.begin() as connection:
         for movie in movies:
@@ -221,11 +206,7 @@ def test_get_watchlist():
                     RETURNING media_id
                     """
                 ),
-                {
-                    "media_type": "movie",
-                    "title": movie,
-                    "director": "Test Director"
-                }
+                {"media_type": "movie", "title": movie, "director": "Test Director"},
             ).scalar_one()
 
             connection.execute(
@@ -234,30 +215,41 @@ def test_get_watchlist():
                     INSERT INTO movies (media_id, length) VALUES (:media_id, :length)
                     """
                 ),
-                {
-                    "media_id": media_id,
-                    "length": 120
-                }
+                {"media_id": media_id, "length": 120},
             )
 
-
     # add movies to watchlist
     for movie in movies[0:3]:
-        add_to_watchlist("testuser44", movie, have_watched=False)
+        await add_to_watchlist("testuser44", movie, have_watched=False)
 
-    watchlist = get_watchlist("testuser44")
-    print(f'watchlist: {watchlist}')
+    watchlist = (await get_watchlist("testuser44")).items
+    print(f"watchlist: {watchlist}")
     assert len(watchlist) == 3
 
     for movie in watchlist:
         assert movie.title in movies[0:3]
         assert movie.director == "Test Director"
         assert movie.have_watched == False
-    
+
     for movie in watchlist:
         assert movie.title not in movies[3:]
-    
 
+    # page through the watchlist two items at a time
+    first_page = await get_watchlist("testuser44", limit=2)
+    assert len(first_page.items) == 2
+    assert first_page.next_cursor is not None
+    second_page = await get_watchlist(
+        "testuser44", limit=2, cursor=first_page.next_cursor
+    )
+    assert len(second_page.items) == 1
+    assert second_page.next_cursor is None
+    assert [m.title for m in first_page.items + second_page.items] == [
+        m.title for m in watchlist
+    ]
+    # a well-formed cursor with the wrong key types is as invalid as garbage
+    with pytest.raises(HTTPException) as exception:
+        await get_watchlist("testuser44", limit=2, cursor=encode_cursor(["x"]))
+    assert exception.value.status_code == 400
 
     with db.engine.begin() as connection:
         # tear down
@@ -270,9 +262,10 @@ def test_get_watchlist():
         )
 
 
-def test_mark_as_watched():
+@pytest.mark.anyio
+async def test_mark_as_watched():
     # create a new user
-    create_new_user("testuser55")
+    await create_new_user("testuser55")
 
     # add Test Movie to db
     with db.engine.begin() as connection:
@@ -283,11 +276,7 @@ def test_mark_as_watched():
                 RETURNING media_id
                 """
             ),
-            {
-                "media_type": "movie",
-                "title": "Test Movie",
-                "director": "Test Director"
-            }
+            {"media_type": "movie", "title": "Test Movie", "director": "Test Director"},
         ).scalar_one()
 
         connection.execute(
@@ -296,26 +285,220 @@ def test_mark_as_watched():
                 INSERT INTO movies (media_id, length) VALUES (:media_id, :length)
                 """
             ),
-            {
-                "media_id": media_id,
-                "length": 120
-            }
+            {"media_id": media_id, "length": 120},
         )
-    add_to_watchlist("testuser55", "Test Movie", have_watched=False)
-    
-    watchlist = get_watchlist("testuser55")
+    await add_to_watchlist("testuser55", "Test Movie", have_watched=False)
+
+    watchlist = (await get_watchlist("testuser55")).items
     assert len(watchlist) == 1
 
-    watchlist = get_watchlist("testuser55", only_watched_media=True)
+    watchlist = (await get_watchlist("testuser55", only_watched_media=True)).items
     assert len(watchlist) == 0
+    summary = await get_watchlist_summary("testuser55")
+    assert (summary.total, summary.watched, summary.unwatched) == (1, 0, 1)
 
     # mark as watched
-    mark_as_watched("testuser55", "Test Movie")
-    watchlist = get_watchlist("testuser55", only_watched_media=True)
+    await mark_as_watched("testuser55", "Test Movie")
+    watchlist = (await get_watchlist("testuser55", only_watched_media=True)).items
     assert len(watchlist) == 1
+    summary = await get_watchlist_summary("testuser55")
+    assert (summary.total, summary.watched, summary.unwatched) == (1, 1, 0)
+
+    # the profile reads its watchlist size in the same query
+    with count_queries() as stats:
+        assert (await view_user("testuser55")).size_of_watchlist == 1
+    assert stats.queries == 1
+
+    with pytest.raises(HTTPException) as exception:
+        await get_watchlist_summary("nobody55")
+    assert exception.value.status_code == 404
+
+    with db.engine.begin() as connection:
+        # tear down
+        connection.execute(
+            sqlalchemy.text(
+                """
+                TRUNCATE movies, tv_shows, media, watchlists, users, reviews CASCADE
+                """
+            )
+        )
+
+
+@pytest.mark.anyio
+async def test_get_suggested_friends():
+    for username in ["friendA", "friendB", "friendC", "friendD", "friendE", "friendF"]:
+        await create_new_user(username)
+
+    with db.engine.begin() as connection:
+        ids = {
+            row.username: row.id
+            for row in connection.execute(
+                sqlalchemy.text("SELECT id, username FROM users")
+            )
+        }
+        friends = {
+            "friendA": ["friendB", "friendC"],
+            "friendB": ["friendA", "friendD", "friendE"],
+            "friendC": ["friendD", "friendE", "friendF"],
+        }
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO friendships (user_id, friend_id) VALUES (:user_id, :friend_id)"
+            ),
+            [
+                {"user_id": ids[username], "friend_id": ids[friend]}
+                for username, friend_usernames in friends.items()
+                for friend in friend_usernames
+            ],
+        )
+
+    # the user lookup, then one query for all friends of friends
+    with count_queries() as stats:
+        suggestions = await get_suggested_friends("friendA", min_mutual=1)
+    assert stats.queries == 2
+    assert [(s.username, s.mutual_friends) for s in suggestions] == [
+        ("friendD", 2),
+        ("friendE", 2),
+        ("friendF", 1),
+    ]
+    assert [
+        s.username
+        for s in await get_suggested_friends("friendA", min_mutual=2, limit=1)
+    ] == ["friendD"]
+
+    with pytest.raises(HTTPException) as exception:
+        await get_suggested_friends("friendA")
+    assert exception.value.status_code == 404
 
+    with db.engine.begin() as connection:
+        # tear down
+        connection.execute(
+            sqlalchemy.text(
+                """
+                TRUNCATE movies, tv_shows, media, watchlists, users, reviews CASCADE
+                """
+            )
+        )
 
 
+@pytest.mark.anyio
+async def test_add_and_remove_friend():
+    for username in ["friendA", "friendB", "friendC"]:
+        await create_new_user(username)
+
+    await add_friend("friendA", Username(username="friendB"))
+    await add_friend("friendC", Username(username="friendB"))
+
+    with pytest.raises(HTTPException) as exception:
+        await add_friend("friendA", Username(username="friendB"))
+    assert exception.value.status_code == 409
+
+    assert [f.username for f in await get_followers("friendB")] == [
+        "friendA",
+        "friendC",
+    ]
+
+    await remove_friend("friendA", "friendB")
+    assert [f.username for f in await get_followers("friendB")] == ["friendC"]
+
+    with pytest.raises(HTTPException) as exception:
+        await remove_friend("friendA", "friendB")
+    assert exception.value.status_code == 404
+
+    with db.engine.begin() as connection:
+        # tear down
+        connection.execute(
+            sqlalchemy.text(
+                """
+                TRUNCATE movies, tv_shows, media, watchlists, users, reviews CASCADE
+                """
+            )
+        )
+
+
+@pytest.mark.anyio
+async def test_search_users_pagination():
+    for username in ["pageuser1", "pageuser2", "pageuser3", "otheruser"]:
+        await create_new_user(username)
+
+    # pages come back already serialized
+    first_page = json.loads((await search_users("pageuser", limit=2)).body)
+    assert first_page["items"] == [{"username": "pageuser1"}, {"username": "pageuser2"}]
+    second_page = json.loads(
+        (await search_users("pageuser", limit=2, cursor=first_page["next_cursor"])).body
+    )
+    assert second_page == {"items": [{"username": "pageuser3"}], "next_cursor": None}
+
+    assert len(json.loads((await search_users()).body)["items"]) == 4
+
+    with pytest.raises(HTTPException) as exception:
+        await search_users(cursor="not a cursor")
+    assert exception.value.status_code == 400
+    for key in ([1], [True], ["\x00"]):
+        with pytest.raises(HTTPException) as exception:
+            await search_users(cursor=encode_cursor(key))
+        assert exception.value.status_code == 400
+
+    with db.engine.begin() as connection:
+        # tear down
+        connection.execute(
+            sqlalchemy.text(
+                """
+                TRUNCATE movies, tv_shows, media, watchlists, users, reviews CASCADE
+                """
+            )
+        )
+
+
+@pytest.mark.anyio
+async def test_add_to_watchlist_bulk():
+    await create_new_user("bulkuser")
+
+    with db.engine.begin() as connection:
+        for movie in ["bulkmovie1", "bulkmovie2", "bulkmovie3"]:
+            connection.execute(
+                sqlalchemy.text(
+                    """
+                    INSERT INTO media (media_type, title, director) VALUES ('movie', :title, 'Test Director')
+                    """
+                ),
+                {"title": movie},
+            )
+
+    await add_to_watchlist("bulkuser", "bulkmovie1", have_watched=False)
+
+    # the import is set based, a query per title would trip the repeat limit
+    with count_queries(repeat_limit=1) as stats:
+        results = await add_to_watchlist_bulk(
+            "bulkuser",
+            [
+                WatchlistImportItem(title="bulkmovie1"),
+                WatchlistImportItem(title="bulkmovie2", have_watched=True),
+                WatchlistImportItem(title="bulkmovie2"),
+                WatchlistImportItem(title="notamovie"),
+                WatchlistImportItem(title="bulkmovie3"),
+            ],
+        )
+    assert stats.queries <= 4
+    assert [(r.title, r.status) for r in results] == [
+        ("bulkmovie1", "already_in_watchlist"),
+        ("bulkmovie2", "added"),
+        ("bulkmovie2", "already_in_watchlist"),
+        ("notamovie", "not_found"),
+        ("bulkmovie3", "added"),
+    ]
+
+    watchlist = (await get_watchlist("bulkuser")).items
+    assert [(m.title, m.have_watched) for m in watchlist] == [
+        ("bulkmovie1", False),
+        ("bulkmovie2", True),
+        ("bulkmovie3", False),
+    ]
+
+    with pytest.raises(HTTPException) as exception:
+        await add_to_watchlist_bulk("nobody", [WatchlistImportItem(title="bulkmovie1")])
+    assert exception.value.status_code == 404
+
     with db.engine.begin() as connection:
         # tear down
         connection.execute(
@@ -0,0 +1,14 @@
+import pytest
+from src import cache
+
+
+# route handlers are async - run the anyio-marked tests on asyncio only
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+# tests write straight to the database, so don't let one test's cached reads leak into the next
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.cache.clear()
@@ -0,0 +1,103 @@
+import time
+import pytest
+from pydantic import TypeAdapter
+from src import cache
+from src import database as db
+from src.api.pagination import Page
+from src.api.users import WatchlistItem
+
+
+def test_sqlite_cache(tmp_path) -> None:
+    backend = cache.SQLiteCache(str(tmp_path / "cache.sqlite3"), max_entries=2, ttl=30)
+    # a second worker on the same host opens the same file
+    other_worker = cache.SQLiteCache(
+        str(tmp_path / "cache.sqlite3"), max_entries=2, ttl=30
+    )
+
+    backend.set("user:a", "view_user:a", b'{"size_of_watchlist": 1}')
+    backend.set("watchlist:a", "get_watchlist:a:1", b"[1]")
+    backend.set("watchlist:a", "get_watchlist:a:2", b"[2]")
+
+    # least recently used entry evicted
+    assert other_worker.get("view_user:a") == (False, None)
+    assert other_worker.get("get_watchlist:a:2") == (True, b"[2]")
+    assert backend.evictions == 1
+
+    backend.invalidate("watchlist:a")
+    assert other_worker.get("get_watchlist:a:1") == (False, None)
+    assert other_worker.size() == 0
+
+
+@pytest.mark.anyio
+async def test_shared_cache_holds_json(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(
+        cache,
+        "cache",
+        cache.SQLiteCache(str(tmp_path / "cache.sqlite3"), max_entries=10, ttl=30),
+    )
+    adapter = TypeAdapter(Page[WatchlistItem])
+    page = Page[WatchlistItem](
+        items=[
+            WatchlistItem(
+                media_id=1, title="media1", director="director1", have_watched=False
+            )
+        ],
+        next_cursor=None,
+    )
+
+    await cache.put("watchlist:a", "get_watchlist:a", page, adapter)
+    # stored as JSON, and handed back as the model
+    assert cache.cache.get("get_watchlist:a") == (True, page.model_dump_json().encode())
+    assert await cache.get("get_watchlist:a", adapter) == (True, page)
+
+    # anything that isn't the model, say a pickle, is a miss rather than something to load
+    cache.cache.set("watchlist:a", "get_watchlist:b", b"\x80\x04K\x01.")
+    assert await cache.get("get_watchlist:b", adapter) == (False, None)
+
+
+def test_invalidation_listener(tmp_path, monkeypatch) -> None:
+    listener = cache.start_listener(db.engine.url)
+    assert listener is not None
+    try:
+        assert listener.listening.wait(5)
+        cache.cache.set("user:listener", "view_user:listener", "profile")
+        cache.cache.set("user:other", "view_user:other", "profile")
+
+        # another worker's write - the notification is only delivered on commit
+        with db.engine.begin() as connection:
+            connection.execute(
+                cache.NOTIFY_STATEMENT,
+                [{"channel": cache.CHANNEL, "tags": ["user:listener"]}],
+            )
+
+        deadline = time.monotonic() + 5
+        while cache.cache.get("view_user:listener")[0] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert cache.cache.get("view_user:listener") == (False, None)
+        assert cache.cache.get("view_user:other") == (True, "profile")
+    finally:
+        listener.stop()
+
+    # connecting clears a worker's own cache, but never one every worker shares
+    shared = cache.SQLiteCache(str(tmp_path / "cache.sqlite3"), max_entries=10, ttl=30)
+    shared.set("user:shared", "view_user:shared", b"{}")
+    monkeypatch.setattr(cache, "cache", shared)
+    listener = cache.start_listener(db.engine.url)
+    assert listener is not None
+    try:
+        assert listener.listening.wait(5)
+        assert shared.get("view_user:shared") == (True, b"{}")
+    finally:
+        listener.stop()
+
+
+def test_depopulate_clears_shared_cache(tmp_path, monkeypatch) -> None:
+    from depopulate import depopulate
+
+    shared = cache.SQLiteCache(str(tmp_path / "cache.sqlite3"), max_entries=10, ttl=30)
+    shared.set("media:view", "view_media:shared", b"{}")
+    monkeypatch.setattr(cache, "cache", shared)
+
+    # a script emptying the tables can't leave running workers serving the old pages
+    depopulate()
+    assert shared.get("view_media:shared") == (False, None)
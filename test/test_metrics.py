@@ -0,0 +1,95 @@
+import logging
+import pytest
+import sqlalchemy
+from fastapi.testclient import TestClient
+from src import database as db
+from src.api.server import app
+from src.metrics import metrics, count_queries, QueryBudgetExceeded
+
+
+def test_metrics() -> None:
+    with db.engine.begin() as connection:
+        connection.execute(sqlalchemy.text("TRUNCATE users CASCADE"))
+    client = TestClient(app)
+    metrics.routes.clear()
+
+    client.post("/users/metricsuser")
+    client.get("/users/metricsuser")
+    client.get("/users/nosuchuser")
+    client.get("/no/such/path")
+
+    body = client.get("/metrics").text
+    samples = dict(
+        line.rsplit(" ", 1) for line in body.splitlines() if not line.startswith("#")
+    )
+
+    # recorded under the route template, by status
+    assert (
+        samples[
+            'http_requests_total{method="GET",route="/users/{username}",status="200"}'
+        ]
+        == "1"
+    )
+    assert (
+        samples[
+            'http_requests_total{method="GET",route="/users/{username}",status="404"}'
+        ]
+        == "1"
+    )
+    assert (
+        samples['http_requests_total{method="GET",route="unmatched",status="404"}']
+        == "1"
+    )
+    assert (
+        samples[
+            'http_request_duration_seconds_count{method="GET",route="/users/{username}"}'
+        ]
+        == "2"
+    )
+    assert (
+        'http_request_duration_quantile_seconds{method="GET",route="/users/{username}",quantile="0.99"}'
+        in samples
+    )
+
+    # creating a user checks for it, then inserts it
+    assert (
+        samples['http_request_queries_sum{method="POST",route="/users/{username}"}']
+        == "2.0"
+    )
+    assert (
+        float(
+            samples[
+                'http_request_db_seconds_sum{method="POST",route="/users/{username}"}'
+            ]
+        )
+        > 0
+    )
+    assert samples["http_requests_in_flight"] == "1"  # the /metrics request itself
+
+
+def test_query_checks(caplog) -> None:
+    # a query per row
+    with pytest.raises(QueryBudgetExceeded, match="same statement 4 times"):
+        with count_queries(repeat_limit=3), db.engine.begin() as connection:
+            for media_id in range(4):
+                connection.execute(
+                    sqlalchemy.text("SELECT title FROM media WHERE media_id = :id"),
+                    {"id": media_id},
+                )
+
+    # distinct statements still count toward the budget
+    with pytest.raises(QueryBudgetExceeded, match="over the budget of 2"):
+        with count_queries(budget=2), db.engine.begin() as connection:
+            for n in range(3):
+                connection.execute(sqlalchemy.text(f"SELECT {n}"))
+
+    # warn mode logs each problem once and lets the request finish
+    with caplog.at_level(logging.WARNING, logger="src.metrics"):
+        with (
+            count_queries(mode="warn", repeat_limit=1) as stats,
+            db.engine.begin() as connection,
+        ):
+            for _ in range(3):
+                connection.execute(sqlalchemy.text("SELECT 1"))
+    assert stats.queries == 3
+    assert len(caplog.records) == 1